@@ -0,0 +1,46 @@
+"""
+Page latency of GET /questions as the question bank grows.
+
+    BENCH_DATABASE_URI=postgresql://... python -m benchmarks.bench_pagination
+
+With pagination done in SQL the first, middle and last pages should cost
+about the same at every table size. The cursor rows fetch the same deep
+pages through keyset pagination, which avoids walking the skipped rows.
+"""
+from benchmarks.common import parse_args, bench_app, seed_questions, time_call, report
+from flaskr import QUESTIONS_PER_PAGE
+from flaskr.pagination import encode_cursor
+from models import db, Question
+
+
+def main():
+    args = parse_args(__doc__)
+    app = bench_app()
+    client = app.test_client()
+
+    for rows in args.rows:
+        seed_questions(app, rows)
+        last_page = max(1, rows // QUESTIONS_PER_PAGE)
+        for page in (1, last_page // 2 or 1, last_page):
+            def fetch():
+                response = client.get(f'/questions?page={page}')
+                assert response.status_code == 200, response.status_code
+            report(f'{rows:>9} rows  GET /questions?page={page}',
+                   time_call(fetch, args.repeat))
+
+        # The cursor for a page is the id of the last row on the page before it.
+        with app.app_context():
+            before = (last_page - 1) * QUESTIONS_PER_PAGE
+            last_id = db.session.query(Question.id).order_by(Question.id) \
+                .offset(before - 1).limit(1).scalar() if before else 0
+        cursor = encode_cursor(last_id)
+
+        def fetch_cursor():
+            response = client.get(f'/questions?cursor={cursor}')
+            assert response.status_code == 200, response.status_code
+        report(f'{rows:>9} rows  GET /questions?cursor=<page {last_page}>',
+               time_call(fetch_cursor, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Latency of one quiz step as the question bank grows.
+
+    BENCH_DATABASE_URI=postgresql://... python -m benchmarks.bench_quiz --rows 100000 1000000
+
+"load all" is the previous implementation: load every remaining question
+of the category and pick one in Python, so it grows with the category.
+"pivot" is random_question(), which reads a single row through the
+(category, id) index and should stay flat at every size.
+
+The session rows time /quizzes/sessions/<id>/next at the start of a
+deck and near its end (default memory store), which should cost the same.
+
+"pools" samples from the worker's in-memory QuizPools; their build time
+and memory per million questions are printed too.
+"""
+import random
+import time
+
+from benchmarks.common import parse_args, bench_app, seed_questions, time_call, report
+from flaskr.quiz import random_question
+from flaskr.quiz.pools import QuizPools
+from models import db, Question
+
+SEEN_SIZES = (0, 20)
+
+
+def load_all(category, seen):
+    query = Question.query.filter(~Question.id.in_(seen))
+    if category is not None:
+        query = query.filter(Question.category == str(category))
+    question = random.choice(query.all()).format()
+    db.session.expunge_all()
+    return question
+
+
+def main():
+    args = parse_args(__doc__)
+    app = bench_app()
+    client = app.test_client()
+
+    for rows in args.rows:
+        seed_questions(app, rows)
+        with app.app_context():
+            pools = QuizPools(app)
+            start = time.perf_counter()
+            pools.build()
+            print(f'{rows:>9} rows  pools built in {time.perf_counter() - start:.2f} s, '
+                  f'{pools.memory_bytes() / rows * 1e6 / 2**20:.1f} MiB per million questions')
+
+            def from_pools(scope, seen):
+                question_id = pools.sample(scope, set(seen))
+                row = db.session.execute(
+                    Question.select_rows().where(Question.id == question_id)).first()
+                return Question.format_row(row)
+
+            category = db.session.query(Question.category).limit(1).scalar()
+            seen_ids = [row[0] for row in db.session.query(Question.id)
+                        .filter(Question.category == category).limit(max(SEEN_SIZES))]
+            for size in SEEN_SIZES:
+                seen = seen_ids[:size]
+                for scope in (category, None):
+                    label = f'category {scope}' if scope is not None else 'all'
+                    for name, fn in (('load all', load_all), ('pivot', random_question),
+                                     ('pools', from_pools)):
+                        samples = time_call(lambda: fn(scope, seen), args.repeat)
+                        report(f'{rows:>9} rows  {name:<8} {label:<11} seen {size:<3}', samples)
+
+        def step():
+            response = client.post('/quizzes', json={
+                'previous_questions': seen_ids, 'quiz_category': {'id': category}})
+            assert response.status_code == 200, response.status_code
+        report(f'{rows:>9} rows  POST /quizzes', time_call(step, args.repeat))
+
+        session_id = client.post('/quizzes/sessions', json={
+            'quiz_category': {'id': category}}).get_json()['session_id']
+        session = app.extensions['quiz_store'].get(session_id)
+
+        def session_step():
+            response = client.post(f'/quizzes/sessions/{session_id}/next')
+            assert response.get_json()['question'] is not None
+        report(f'{rows:>9} rows  session next (deck start)', time_call(session_step, args.repeat))
+        session.position = len(session.deck) - args.repeat - 2
+        app.extensions['quiz_store'].save(session)
+        report(f'{rows:>9} rows  session next (deck end)', time_call(session_step, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Per-row cost of serializing questions through ORM instances versus the
+column-projected row path used by the list endpoints.
+
+    BENCH_DATABASE_URI=postgresql://... python -m benchmarks.bench_row_path --rows 100000
+
+Both paths run the same SELECT; the difference is building Question
+instances (identity map, attribute instrumentation) and calling format()
+versus zipping plain rows into dicts.
+"""
+import tracemalloc
+
+from benchmarks.common import parse_args, bench_app, seed_questions, time_call, report
+from models import db, Question
+
+BATCH_SIZES = (10, 1000, 10000)
+
+
+def orm_path(limit):
+    rows = Question.query.order_by(Question.id).limit(limit).all()
+    result = [q.format() for q in rows]
+    db.session.expunge_all()
+    return result
+
+
+def row_path(limit):
+    rows = db.session.execute(Question.select_rows().order_by(Question.id).limit(limit)).all()
+    return [Question.format_row(row) for row in rows]
+
+
+def peak_allocation_kb(fn, limit):
+    tracemalloc.start()
+    fn(limit)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main():
+    args = parse_args(__doc__, default_rows=(100000,))
+    app = bench_app()
+
+    for rows in args.rows:
+        seed_questions(app, rows)
+        with app.app_context():
+            for limit in BATCH_SIZES:
+                for name, fn in (('orm', orm_path), ('rows', row_path)):
+                    samples = time_call(lambda: fn(limit), args.repeat)
+                    report(f'{rows:>9} rows  {name:<4} x{limit}', samples)
+                    print(f'{"":<48} peak alloc {peak_allocation_kb(fn, limit):10.1f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Search latency per mode as the question bank grows.
+
+    BENCH_DATABASE_URI=postgresql://... python -m benchmarks.bench_search --rows 100000 1000000
+
+Compares the default substring (ilike) search, which scans the table,
+with the indexed modes on the same terms. The last rows time the
+in-memory index's own query, without HTTP or row loading.
+
+    python -m benchmarks.bench_search --index-only --rows 1000000
+
+times just InvertedIndex.search over synthetic questions built in
+process, with no database; the first search of each term (which builds
+its impact list) is reported separately.
+"""
+import random
+import time
+
+from benchmarks.common import (parse_args, bench_app, seed_questions, synthetic_question,
+                               time_call, report)
+from flaskr.search.inverted import InvertedIndex
+
+TERMS = ['title', 'world cup', 'palace', 'zzzz', 'palase']
+MODES = ['substring', 'fulltext', 'trigram', 'similar', 'index', 'fuzzy']
+
+
+def index_only(rows, repeat):
+    index = InvertedIndex(app=None)
+    state = index.new_state()
+    rng = random.Random(0)
+    for question_id in range(1, rows + 1):
+        index.add(state, dict(synthetic_question(rng, range(1, 7)), id=question_id))
+    index.finish(state)
+    index.state = state
+    index._synced_version = 0
+    index._checked_at = float('inf')
+    for term in TERMS:
+        start = time.perf_counter()
+        _, total, _, estimated = index.search(term)
+        print(f'{rows:>9} rows  first search {term!r}: {(time.perf_counter() - start) * 1000:.1f} ms, '
+              f'{total} matches{" (estimated)" if estimated else ""}')
+        report(f'{rows:>9} rows  InvertedIndex.search {term!r}',
+               time_call(lambda: index.search(term), repeat))
+
+
+def main():
+    args = parse_args(__doc__, extra=lambda parser: parser.add_argument(
+        '--index-only', action='store_true', help='time InvertedIndex.search alone, without a database'))
+    if args.index_only:
+        for rows in args.rows:
+            index_only(rows, args.repeat)
+        return
+    app = bench_app()
+    client = app.test_client()
+
+    for rows in args.rows:
+        seed_questions(app, rows)
+        index = app.extensions['search_index']
+        with app.app_context():
+            index.build()
+            app.extensions['fuzzy_vocabulary'].build()
+        for mode in MODES:
+            for term in TERMS:
+                def search():
+                    response = client.post('/questions', json={'searchTerm': term, 'searchMode': mode})
+                    assert response.status_code in (200, 404), response.status_code
+                report(f'{rows:>9} rows  {mode:<10} {term!r}', time_call(search, args.repeat))
+        with app.app_context():
+            for term in TERMS:
+                report(f'{rows:>9} rows  InvertedIndex.search {term!r}',
+                       time_call(lambda: index.search(term), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
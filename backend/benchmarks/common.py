@@ -0,0 +1,98 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The benchmarks grow (and sometimes reset) the questions table, so they
+only ever run against the database named by BENCH_DATABASE_URI.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import func, insert
+
+from flaskr import create_app
+from models import db, Question, Category
+
+CATEGORY_TYPES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+
+WORDS = [
+    'title', 'world', 'cup', 'river', 'painting', 'planet', 'element', 'king',
+    'queen', 'battle', 'novel', 'author', 'ocean', 'mountain', 'capital',
+    'player', 'film', 'actor', 'artist', 'organ', 'medicine', 'palace',
+    'empire', 'island', 'language', 'composer', 'team', 'record', 'city',
+    'invented', 'discovered', 'largest', 'first', 'famous', 'ancient',
+]
+
+
+def parse_args(description, default_rows=(100000, 1000000), extra=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--rows', type=int, nargs='+', default=list(default_rows),
+                        help='table sizes to benchmark at')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='timed requests per measurement')
+    if extra is not None:
+        extra(parser)
+    return parser.parse_args()
+
+
+def bench_app():
+    load_dotenv()
+    database_uri = os.getenv('BENCH_DATABASE_URI')
+    if not database_uri:
+        raise SystemExit('Set BENCH_DATABASE_URI to a scratch database; '
+                         'benchmarks rewrite its questions table.')
+    return create_app({'SQLALCHEMY_DATABASE_URI': database_uri})
+
+
+def synthetic_question(rng, category_ids):
+    words = rng.sample(WORDS, 6)
+    return {
+        'question': 'Which {} {} {} the {} {}?'.format(*words[:5]),
+        'answer': words[5].capitalize(),
+        'category': str(rng.choice(category_ids)),
+        'difficulty': rng.randint(1, 5),
+    }
+
+
+def seed_questions(app, total, batch_size=10000, seed=0):
+    """Grow the questions table to exactly ``total`` rows."""
+    rng = random.Random(seed)
+    with app.app_context():
+        if Category.query.count() == 0:
+            db.session.add_all([Category(type=t) for t in CATEGORY_TYPES])
+            db.session.commit()
+        category_ids = [c.id for c in Category.query.all()]
+
+        current = db.session.query(func.count(Question.id)).scalar()
+        if current > total:
+            Question.query.delete()
+            db.session.commit()
+            current = 0
+
+        while current < total:
+            size = min(batch_size, total - current)
+            rows = [synthetic_question(rng, category_ids) for _ in range(size)]
+            db.session.execute(insert(Question), rows)
+            db.session.commit()
+            current += size
+
+
+def time_call(fn, repeat):
+    """Return per-call latencies in milliseconds after one warm-up call."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f'{label:<48} median {statistics.median(samples):8.3f} ms   '
+          f'p95 {p95:8.3f} ms')
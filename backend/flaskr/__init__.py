@@ -1,10 +1,30 @@
 from flask import Flask, request, abort, jsonify
 from flask_cors import CORS
-import random
+import click
+
+from models import (
+    setup_db, apply_migrations, Question, Category, QuestionCount, QuestionChange, DataVersion, db,
+)
+from .versions import VersionStamp, VersionedValue, DATA_VERSION_CHECK_INTERVAL
+from .conditional import conditional
+from .cache import build_response_cache
+from .singleflight import SingleFlight
+from .search import run_search
+from .search.inverted import InvertedIndex
+from .search.suggest import SuggestIndex, SUGGEST_LIMIT, SUGGEST_MAX_LIMIT
+from .search.fuzzy import FuzzyVocabulary
+from .search.results import (
+    SearchResultCache, SEARCH_CACHE_SIZE, normalize_query, search_key, warm_search_cache,
+)
+from .search.telemetry import SearchTelemetry, SEARCH_TOP_K
+from .quiz import random_question, shuffled_deck, next_deck_question, QUIZ_DECK_SIZE
+from .quiz.sessions import build_quiz_store
+from .quiz.permutation import new_seed, permuted_question
+from .quiz.pools import QuizPools
+from .pagination import (
+    QUESTIONS_PER_PAGE, page_args, search_page_args, paginate_questions
+)
 
-from models import setup_db, Question, Category, db
-
-QUESTIONS_PER_PAGE = 10
 
 def create_app(test_config=None):
     # create and configure the app
@@ -13,15 +33,66 @@ def create_app(test_config=None):
     if test_config is None:
         setup_db(app)
     else:
+        app.config.from_mapping(test_config)
         database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
         setup_db(app, database_path=database_path)
+    app.config.setdefault('DATA_VERSION_CHECK_INTERVAL', DATA_VERSION_CHECK_INTERVAL)
 
     """
     @DONETODO: Set up CORS. Allow '*' for origins. Delete the sample
     route after completing the TODOs
     """
+    app.config.setdefault('SEARCH_INDEX', True)
+    app.config.setdefault('SUGGEST_INDEX', True)
+    app.config.setdefault('FUZZY_INDEX', True)
+    app.config.setdefault('QUIZ_POOLS', True)
+
     with app.app_context():
         db.create_all()
+        apply_migrations()
+        QuestionCount.ensure_built()
+
+        # In-memory search index for searchMode=index, built once per worker
+        if app.config['SEARCH_INDEX']:
+            search_index = InvertedIndex(app, app.config['DATA_VERSION_CHECK_INTERVAL'])
+            search_index.build()
+            app.extensions['search_index'] = search_index
+
+        # Prefix index for GET /questions/suggest
+        if app.config['SUGGEST_INDEX']:
+            suggest_index = SuggestIndex(app, app.config['DATA_VERSION_CHECK_INTERVAL'])
+            suggest_index.build()
+            app.extensions['suggest_index'] = suggest_index
+
+        # Vocabulary for correcting misspelled words in searchMode=fuzzy
+        if app.config['FUZZY_INDEX']:
+            fuzzy_vocabulary = FuzzyVocabulary(app, app.config['DATA_VERSION_CHECK_INTERVAL'])
+            fuzzy_vocabulary.build()
+            app.extensions['fuzzy_vocabulary'] = fuzzy_vocabulary
+
+        # Question ids per category for picking POST /quizzes questions
+        if app.config['QUIZ_POOLS']:
+            quiz_pools = QuizPools(app, app.config['DATA_VERSION_CHECK_INTERVAL'])
+            quiz_pools.build()
+            app.extensions['quiz_pools'] = quiz_pools
+
+    @app.cli.command('rebuild-counts')
+    def rebuild_counts():
+        """Recompute question counters, e.g. after loading trivia.psql."""
+        QuestionCount.rebuild()
+        db.session.commit()
+
+    @app.cli.command('bump-version')
+    @click.argument('name')
+    def bump_version(name):
+        """Move a data-version stamp so every worker reloads its cached copy."""
+        # Category types show up in question search results too
+        names = {name, 'questions'} if name == 'categories' else {name}
+        DataVersion.bump(db.session, db.session.connection(), names)
+        if name == 'questions':
+            # Changed rows aren't known: mirrors must reload every question
+            QuestionChange.record(db.session, db.session.connection(), [None])
+        db.session.commit()
 
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     """
@@ -38,14 +109,50 @@ def create_app(test_config=None):
     for all available categories.
     """
 
+    # The {id: type} map changes rarely, so each worker keeps it in memory
+    # until the 'categories' data version moves.
+    category_map = VersionedValue(
+        'categories',
+        lambda: {cat.id: cat.type for cat in Category.query.all()},
+        app.config['DATA_VERSION_CHECK_INTERVAL'])
+    question_version = VersionStamp('questions', app.config['DATA_VERSION_CHECK_INTERVAL'])
+
+    # Read routes opt into the response cache with @response_cache.cached(tags);
+    # committed writes invalidate the tags they touched.
+    response_cache = build_response_cache(app.config)
+    app.extensions['response_cache'] = response_cache
+    DataVersion.subscribe_writes(response_cache.invalidate_tags)
+    response_cache.track_versions({'categories': category_map}, question_version)
+    # On a cache miss, identical concurrent requests share one computation
+    single_flight = SingleFlight()
+    # Results of GET /questions/search, dropped whenever the questions change
+    search_cache = SearchResultCache(
+        question_version, app.config.get('SEARCH_CACHE_SIZE', SEARCH_CACHE_SIZE), {
+            mode: [app.extensions[name] for name in names if name in app.extensions]
+            for mode, names in (('index', ['search_index']),
+                                ('fuzzy', ['search_index', 'fuzzy_vocabulary']))})
+    app.extensions['search_cache'] = search_cache
+    # Server-side quiz state for the /quizzes/sessions endpoints
+    with app.app_context():
+        quiz_store = build_quiz_store(app.config, db.engine)
+    app.extensions['quiz_store'] = quiz_store
+    # Most searched terms, counted in fixed memory
+    search_telemetry = SearchTelemetry(app.config.get('SEARCH_TOP_K', SEARCH_TOP_K))
+    app.extensions['search_telemetry'] = search_telemetry
+    # Pre-compute results for known popular terms, e.g. copied from
+    # GET /admin/search/top
+    if app.config.get('SEARCH_WARM_TERMS'):
+        with app.app_context():
+            warm_search_cache(search_cache, app.config['SEARCH_WARM_TERMS'])
+
     @app.route('/categories', methods=['GET'])
+    @conditional(category_map)
+    @response_cache.cached('categories')
+    @single_flight.coalesce
     def get_categories():
-        categories_list = Category.query.all()
-        categories_dict = {cat.id: cat.type for cat in categories_list}
-
         return jsonify({
             'success': True,
-            'categories': categories_dict
+            'categories': category_map.get()
         }), 200
 
     """
@@ -62,23 +169,72 @@ def create_app(test_config=None):
     should update the questions.
     """
     @app.route('/questions', methods=['GET'])
+    @conditional(question_version, category_map)
+    @response_cache.cached('questions:list', 'categories')
+    @single_flight.coalesce
     def get_questions():
-        page = request.args.get('page', 1, type=int)
-        per_page = QUESTIONS_PER_PAGE
-        questions_query = Question.query.order_by(Question.id).all()
-        formatted_questions = [q.format() for q in questions_query]
-        paginated = formatted_questions[(page-1)*per_page: page*per_page]
+        try:
+            page, cursor, per_page = page_args(request.args)
+            paginated, next_cursor = paginate_questions(
+                Question.select_rows(), page, cursor, per_page)
+        except ValueError:
+            abort(400)
 
         if not paginated:
             abort(404)
 
-        categories = {cat.id: cat.type for cat in Category.query.all()}
+        categories = category_map.get()
 
         return jsonify({
             'success': True,
             'questions': paginated,
-            'totalQuestions': len(formatted_questions),
+            'totalQuestions': QuestionCount.get(),
             'categories': categories,
+            'currentCategory': None,
+            'next_cursor': next_cursor
+        }), 200
+
+    @app.route('/questions/suggest', methods=['GET'])
+    def suggest_questions():
+        prefix = request.args.get('prefix', '').strip()
+        limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+        suggest_index = app.extensions.get('suggest_index')
+        if not prefix or limit < 1 or suggest_index is None:
+            abort(400)
+
+        terms, questions = suggest_index.suggest(prefix, min(limit, SUGGEST_MAX_LIMIT))
+        return jsonify({
+            'success': True,
+            'prefix': prefix,
+            'terms': terms,
+            'questions': questions
+        }), 200
+
+    @app.route('/questions/search', methods=['GET'])
+    @conditional(question_version)
+    def search_questions():
+        search = normalize_query(request.args.get('q', ''))
+        if not search:
+            abort(400)
+        search_telemetry.record(search)
+        options = request.args.to_dict()
+        for flag in ('facets', 'highlight'):
+            options[flag] = request.args.get(flag, '').lower() in ('1', 'true')
+        mode = options.get('mode')
+        try:
+            page, limit = search_page_args(options)
+            key = search_key(mode, search, page, limit, options)
+            results = search_cache.get_or_search(key, lambda: single_flight.do(
+                key, lambda: run_search(mode, search, page, limit, options)))
+        except ValueError:
+            abort(400)
+
+        if not results['questions']:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            **results,
             'currentCategory': None
         }), 200
 
@@ -93,8 +249,7 @@ def create_app(test_config=None):
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
     def remove_question(question_id):
         question = Question.query.get_or_404(question_id)
-        db.session.delete(question)
-        db.session.commit()
+        question.delete()
         return jsonify({
             'success': True,
             'id': question_id
@@ -127,16 +282,23 @@ def create_app(test_config=None):
     def add_or_search_question():
         payload = request.get_json()
         search = payload.get('searchTerm', None)
+        if search is not None and not isinstance(search, str):
+            abort(400)
 
         if search:
-            matches = Question.query.filter(Question.question.ilike(f"%{search}%")).all()
-            if not matches:
+            search_telemetry.record(normalize_query(search))
+            try:
+                page, limit = search_page_args(payload)
+                results = run_search(payload.get('searchMode'), search, page, limit, payload)
+            except ValueError:
+                abort(400)
+
+            if not results['questions']:
                 abort(404)
-            results = [m.format() for m in matches]
+
             return jsonify({
                 'success': True,
-                'questions': results,
-                'totalQuestions': len(results),
+                **results,
                 'currentCategory': None
             }), 200
 
@@ -168,15 +330,65 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @conditional(question_version, category_map)
+    @response_cache.cached(
+        'categories', 'questions:bulk', lambda category_id: f'category:{category_id}')
+    @single_flight.coalesce
     def get_questions_by_category(category_id):
         category_obj = Category.query.get_or_404(category_id)
-        filtered_questions = Question.query.filter_by(category=str(category_id)).all()
-        formatted = [q.format() for q in filtered_questions]
+        try:
+            page, cursor, per_page = page_args(request.args)
+            formatted, next_cursor = paginate_questions(
+                Question.select_rows().where(Question.category == str(category_id)),
+                page, cursor, per_page)
+        except ValueError:
+            abort(400)
+
+        # An empty category still has a (blank) first page
+        if not formatted and (page != 1 or cursor):
+            abort(404)
+
         return jsonify({
             'success': True,
             'questions': formatted,
-            'totalQuestions': len(formatted),
-            'currentCategory': category_obj.type
+            'totalQuestions': QuestionCount.get(category_id),
+            'currentCategory': category_obj.type,
+            'next_cursor': next_cursor
+        }), 200
+
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
+        return jsonify({
+            'success': True,
+            'totalQuestions': QuestionCount.get(),
+            'categories': QuestionCount.by_category()
+        }), 200
+
+    @app.route('/admin/cache/stats', methods=['GET'])
+    def get_cache_stats():
+        return jsonify({
+            'success': True,
+            **response_cache.stats(),
+            'coalesced': single_flight.coalesced,
+            'search': search_cache.stats()
+        }), 200
+
+    @app.route('/admin/search/top', methods=['GET'])
+    def get_top_searches():
+        limit = request.args.get('limit', type=int)
+        return jsonify({
+            'success': True,
+            'searches': search_telemetry.searches,
+            'terms': [{'term': term, 'count': count}
+                      for term, count in search_telemetry.top(limit)]
+        }), 200
+
+    @app.route('/admin/search/warm', methods=['POST'])
+    def warm_top_searches():
+        terms = [term for term, _ in search_telemetry.top()]
+        return jsonify({
+            'success': True,
+            'warmed': warm_search_cache(search_cache, terms)
         }), 200
 
     """
@@ -195,33 +407,102 @@ def create_app(test_config=None):
         data = request.get_json()
 
         # Safely grab previous questions and category ID from the request
-        seen_questions = data.get('previous_questions', [])
+        try:
+            seen_questions = {int(i) for i in data.get('previous_questions', [])}
+        except (TypeError, ValueError):
+            abort(400)
         selected_category = data.get('quiz_category', {}).get('id', None)
 
-        # Filter out questions already asked, and by category if provided
-        if selected_category and str(selected_category) != "0":
-            available_questions = Question.query.filter(
-                Question.category == str(selected_category),
-                ~Question.id.in_(seen_questions)
-            ).all()
-        else:
-            available_questions = Question.query.filter(
-                ~Question.id.in_(seen_questions)
-            ).all()
+        # Stateless shuffled mode: the client keeps only (seed, index)
+        if 'index' in data:
+            try:
+                quiz_pools = app.extensions.get('quiz_pools')
+                seed = (int(data['seed']) if data.get('seed') is not None
+                        else new_seed(selected_category, quiz_pools))
+                next_question, index, done = permuted_question(
+                    selected_category, seed, int(data['index']), quiz_pools)
+            except (TypeError, ValueError):
+                abort(400)
+            return jsonify({
+                "success": True,
+                "question": next_question,
+                "seed": seed,
+                "index": index,
+                "done": done
+            }), 200
+
+        # Pick one remaining question at random: from this worker's id
+        # pools when it has them, otherwise inside the database
+        next_question = None
+        quiz_pools = app.extensions.get('quiz_pools')
+        if quiz_pools is not None:
+            question_id = quiz_pools.sample(selected_category, seen_questions)
+            if question_id is not None:
+                row = db.session.execute(
+                    Question.select_rows().where(Question.id == question_id)).first()
+                next_question = Question.format_row(row) if row is not None else None
+        if next_question is None:
+            # No pools, none left in them, or a question another worker
+            # has just deleted: let the database decide
+            next_question = random_question(selected_category, seen_questions)
 
         # If no questions remain, return success with no question
-        if not available_questions:
+        if next_question is None:
             return jsonify({
                 "success": True,
                 "question": None
             }), 200
 
-        # Pick one question at random from what's left
-        next_question = random.choice(available_questions)
+        return jsonify({
+            "success": True,
+            "question": next_question
+        }), 200
 
+    # Quiz sessions deal questions from a deck shuffled at the start and
+    # kept on the server, so a step doesn't depend on how long the quiz has run
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        data = request.get_json(silent=True) or {}
+        category = (data.get('quiz_category') or {}).get('id')
+        category = None if category is None else str(category)
+        deck = shuffled_deck(category, app.config.get('QUIZ_DECK_SIZE', QUIZ_DECK_SIZE),
+                             app.extensions.get('quiz_pools'))
+        session = quiz_store.create(category, deck)
+        return jsonify({
+            "success": True,
+            "session_id": session.id,
+            "expires_in": quiz_store.ttl
+        }), 201
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_session_question(session_id):
+        # A concurrent step of the same session may store its position
+        # first; then deal again from the position it left
+        while True:
+            session = quiz_store.get(session_id)
+            if session is None:
+                abort(404)
+            position = session.position
+            next_question = next_deck_question(quiz_store, session)
+            if quiz_store.advance(session, position):
+                break
+
+        return jsonify({
+            "success": True,
+            "question": next_question,
+            "asked": session.asked
+        }), 200
+
+    @app.route('/quizzes/sessions/<session_id>/finish', methods=['POST'])
+    def finish_quiz_session(session_id):
+        session = quiz_store.get(session_id)
+        if session is None:
+            abort(404)
+        quiz_store.delete(session_id)
         return jsonify({
             "success": True,
-            "question": next_question.format()
+            "session_id": session_id,
+            "asked": session.asked
         }), 200
 
     """
@@ -0,0 +1,330 @@
+"""
+Response cache for the read endpoints.
+
+Entries are keyed on method, path and the sorted query string, and hold
+the status, mimetype and body of a 200 response. Each entry also records
+the tags it depends on (e.g. 'categories', 'questions:list', 'category:3')
+together with the token each tag had when the entry was stored.
+Invalidating a tag gives it a fresh token, so every entry stored under
+the old one misses from then on; backends never have to find entries by
+tag.
+
+Tag tokens of a shared backend are invalidated for every worker at once.
+A MemoryBackend only hears about this worker's commits, so its tokens
+also carry the data version behind each tag (see track_versions()):
+another worker's write moves the version, which every worker sees within
+DATA_VERSION_CHECK_INTERVAL, and the old entries miss from then on.
+
+Three backends share one small interface:
+
+- MemoryBackend: per-worker LRU with TTL.
+- FileBackend: JSON files in a directory shared by every worker.
+- RedisBackend: a Redis (or compatible) server, for multiple hosts.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import request, make_response
+
+RESPONSE_CACHE_TTL = 30
+RESPONSE_CACHE_SIZE = 1024
+
+
+def request_key():
+    """Cache key of the current request: method, path and sorted query string."""
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f'{request.method} {request.path}?{query}'
+
+
+class MemoryBackend:
+    name = 'memory'
+    shared = False
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_tag(self, tag):
+        return self._tags.get(tag, '')
+
+    def set_tag(self, tag, token):
+        self._tags[tag] = token
+
+
+class FileBackend:
+    """
+    One JSON file per entry under ``directory``. Writes go through a temp
+    file and os.replace(), so readers in other workers never see a partial
+    entry. Once there are more than ``max_entries`` files the oldest ones
+    are removed.
+    """
+    name = 'file'
+    shared = True
+
+    def __init__(self, directory, max_entries=RESPONSE_CACHE_SIZE):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.evictions = 0
+        os.makedirs(os.path.join(directory, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, hashlib.sha1(key.encode()).hexdigest())
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        path = self._path('entries', key)
+        item = self._read(path)
+        if item is None:
+            return None
+        if item['expires_at'] <= time.time():
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            return None
+        return item['value']
+
+    def set(self, key, value, ttl):
+        self._write(self._path('entries', key), {'expires_at': time.time() + ttl, 'value': value})
+        self._evict()
+
+    def _evict(self):
+        entries = os.path.join(self.directory, 'entries')
+        names = [n for n in os.listdir(entries) if not n.endswith('.tmp')]
+        if len(names) <= self.max_entries:
+            return
+        paths = [os.path.join(entries, n) for n in names]
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(os.listdir(os.path.join(self.directory, 'entries')))
+
+    def get_tag(self, tag):
+        item = self._read(self._path('tags', tag))
+        return item or ''
+
+    def set_tag(self, tag, token):
+        self._write(self._path('tags', tag), token)
+
+
+class RedisBackend:
+    """
+    Entries live in a Redis server with native expiry; Redis does its own
+    eviction under memory pressure, so ``evictions`` stays at 0 here.
+    Entries and tag tokens sit under separate ``prefix`` namespaces, and
+    len() counts only the entries with a SCAN (it walks the whole key
+    space, so it is meant for the stats endpoint). ``client`` is anything
+    with Redis-style get/set(ex=)/scan_iter(match=), which lets tests pass
+    an in-process stand-in.
+    """
+    name = 'redis'
+    shared = True
+
+    def __init__(self, client, prefix='trivia:cache:'):
+        self.client = client
+        self.prefix = prefix
+        self.evictions = 0
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE=redis needs the redis package installed')
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + 'entry:' + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + 'entry:' + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + 'entry:*', count=1000))
+
+    def get_tag(self, tag):
+        token = self.client.get(self.prefix + 'tag:' + tag)
+        return token.decode() if isinstance(token, bytes) else (token or '')
+
+    def set_tag(self, tag, token):
+        self.client.set(self.prefix + 'tag:' + tag, token)
+
+
+class NullBackend:
+    """Used when RESPONSE_CACHE is off: stores nothing."""
+    name = 'none'
+    shared = True
+    evictions = 0
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def __len__(self):
+        return 0
+
+    def get_tag(self, tag):
+        return ''
+
+    def set_tag(self, tag, token):
+        pass
+
+
+class ResponseCache:
+
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.counters = Counter()
+        self._versions = {}
+        self._default_version = None
+
+    def track_versions(self, stamps, default):
+        """
+        Fold data versions into the tag tokens of a backend other workers
+        can't invalidate: ``stamps`` maps a tag to the VersionStamp it
+        follows, and every other tag follows ``default``.
+        """
+        if not self.backend.shared:
+            self._versions = dict(stamps)
+            self._default_version = default
+
+    def tag_token(self, tag):
+        token = self.backend.get_tag(tag)
+        if self._versions:
+            stamp = self._versions.get(tag, self._default_version)
+            token = f'{token}@{stamp.current()}'
+        return token
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if entry is not None and all(
+                self.tag_token(tag) == token for tag, token in entry['tags'].items()):
+            self.counters['hits'] += 1
+            return entry
+        self.counters['misses'] += 1
+        return None
+
+    def tag_tokens(self, tags):
+        return {tag: self.tag_token(tag) for tag in tags}
+
+    def set(self, key, response, tokens):
+        """Store ``response``; ``tokens`` must be read before the response was built."""
+        self.backend.set(key, {
+            'tags': tokens,
+            'status': response.status_code,
+            'mimetype': response.mimetype,
+            'body': response.get_data(as_text=True),
+        }, self.ttl)
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            self.backend.set_tag(tag, uuid.uuid4().hex)
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'hits': self.counters['hits'],
+            'misses': self.counters['misses'],
+            'evictions': self.backend.evictions,
+            'entries': len(self.backend),
+        }
+
+    def cached(self, *tags):
+        """
+        Cache a GET view's 200 responses under ``tags``. A tag may be a
+        callable taking the view's keyword arguments, e.g.
+        ``lambda category_id: f'category:{category_id}'``.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                key = request_key()
+                entry = self.get(key)
+                if entry is not None:
+                    response = make_response(entry['body'], entry['status'])
+                    response.mimetype = entry['mimetype']
+                    return response
+                # Read the tag tokens first so a write that lands while the
+                # view runs leaves the stored entry already invalid.
+                tokens = self.tag_tokens(tag(**kwargs) if callable(tag) else tag for tag in tags)
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    self.set(key, response, tokens)
+                return response
+            return wrapped
+        return decorator
+
+
+def build_response_cache(config):
+    """Create the cache described by the RESPONSE_CACHE* settings."""
+    kind = config.get('RESPONSE_CACHE', 'memory')
+    size = config.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE)
+    if not kind:
+        backend = NullBackend()
+    elif kind == 'memory':
+        backend = MemoryBackend(size)
+    elif kind == 'file':
+        backend = FileBackend(config['RESPONSE_CACHE_DIR'], size)
+    elif kind == 'redis':
+        backend = RedisBackend.from_url(config['RESPONSE_CACHE_URL'])
+    else:
+        raise ValueError(f'unknown RESPONSE_CACHE backend: {kind!r}')
+    return ResponseCache(backend, config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL))
@@ -0,0 +1,128 @@
+"""
+Pagination helpers for the question list endpoints.
+
+Pages can be addressed two ways:
+
+- ``?page=N`` uses LIMIT/OFFSET, which is simple but gets slower the
+  deeper the page because the database still walks the skipped rows.
+- ``?cursor=...`` uses keyset pagination on ``Question.id``
+  (``WHERE id > :last ORDER BY id LIMIT n``), so every page costs the
+  same index range scan. Ids only ever grow, which keeps a cursor valid
+  while questions are added or removed.
+"""
+import base64
+import binascii
+import json
+
+from sqlalchemy import func, select
+
+from models import Question, db
+
+QUESTIONS_PER_PAGE = 10
+MAX_PER_PAGE = 100
+
+# Search pages are capped harder than list pages, and match counts above
+# the threshold come from the query planner instead of a full count.
+SEARCH_MAX_LIMIT = 50
+SEARCH_COUNT_THRESHOLD = 1000
+
+CURSOR_PREFIX = 'id:'
+
+
+def encode_cursor(last_id):
+    token = f'{CURSOR_PREFIX}{last_id}'.encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the last seen id stored in ``cursor``; raise ValueError if malformed."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        token = base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(f'malformed cursor: {cursor!r}')
+    if not token.startswith(CURSOR_PREFIX):
+        raise ValueError(f'malformed cursor: {cursor!r}')
+    return int(token[len(CURSOR_PREFIX):])
+
+
+def page_args(args):
+    """
+    Read ``page``, ``cursor`` and ``per_page`` from request args.
+
+    ``per_page`` is capped at MAX_PER_PAGE; a non-positive value raises
+    ValueError like a malformed cursor does.
+    """
+    page = args.get('page', 1, type=int)
+    cursor = args.get('cursor')
+    per_page = args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+    if per_page < 1:
+        raise ValueError(f'per_page must be positive, got {per_page}')
+    return page, cursor, min(per_page, MAX_PER_PAGE)
+
+
+def search_page_args(payload):
+    """Read ``page`` and ``limit`` from a search payload, capping ``limit``."""
+    try:
+        page = int(payload.get('page', 1))
+        limit = int(payload.get('limit', QUESTIONS_PER_PAGE))
+    except (TypeError, ValueError):
+        raise ValueError('page and limit must be integers')
+    if limit < 1:
+        raise ValueError(f'limit must be positive, got {limit}')
+    return page, min(limit, SEARCH_MAX_LIMIT)
+
+
+def count_matches(stmt, threshold=SEARCH_COUNT_THRESHOLD):
+    """
+    Count the rows of ``stmt``, reading at most ``threshold + 1`` of them.
+
+    Returns ``(total, estimated)``. Past the threshold the total is the
+    planner's row estimate (on PostgreSQL), so a one-letter search never
+    pays for counting the whole bank.
+    """
+    bounded = select(func.count()).select_from(stmt.limit(threshold + 1).subquery())
+    total = db.session.execute(bounded).scalar()
+    if total <= threshold:
+        return total, False
+    return max(threshold + 1, estimate_rows(stmt)), True
+
+
+def estimate_rows(stmt):
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return 0
+    compiled = stmt.compile(dialect=connection.dialect)
+    plan = connection.exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginate_questions(stmt, page=1, cursor=None, per_page=QUESTIONS_PER_PAGE, order_by=None):
+    """
+    Fetch one page of ``stmt``, a ``Question.select_rows()`` statement
+    with any filters applied. Pages are id-ordered unless ``order_by``
+    (e.g. a relevance rank) is given, in which case only ``page`` works.
+
+    Returns ``(questions, next_cursor)``. One extra row is read to know
+    whether another page follows; ``next_cursor`` is None on the last page
+    and for custom orderings.
+    """
+    if cursor is not None:
+        if order_by is not None:
+            raise ValueError('cursor pagination needs id ordering')
+        stmt = stmt.where(Question.id > decode_cursor(cursor))
+    elif page < 1:
+        return [], None
+
+    stmt = stmt.order_by(*(order_by if order_by is not None else [Question.id]))
+    if cursor is None:
+        stmt = stmt.offset((page - 1) * per_page)
+    rows = db.session.execute(stmt.limit(per_page + 1)).all()
+
+    questions = [Question.format_row(row) for row in rows[:per_page]]
+    has_next = len(rows) > per_page and order_by is None
+    next_cursor = encode_cursor(rows[per_page - 1].id) if has_next else None
+    return questions, next_cursor
@@ -0,0 +1,119 @@
+"""
+Question selection for POST /quizzes and quiz sessions.
+
+The next question is picked inside the database, and only that row is
+ever loaded. A random pivot id is drawn between the smallest and largest
+id of the category, then the first remaining question at or after the
+pivot is read (wrapping around to the start of the range). With the
+(category, id) index both steps are index lookups, so a quiz step costs
+the same whatever the size of the category.
+
+Questions the player has already seen are skipped while walking the
+index from the pivot, a batch of ids at a time, rather than excluded
+with a ``NOT IN`` list that grows with every step.
+
+Each question is picked with probability proportional to the id gap in
+front of it (plus the seen questions just before it); ids are dense
+apart from deleted questions, so this stays close to uniform.
+
+Quiz sessions instead deal questions from a deck shuffled when the
+session starts (see sessions.py). A deck holds at most QUIZ_DECK_SIZE
+ids: drawn from the worker's quiz pools in O(deck size) when it has
+them, otherwise by one ``ORDER BY random() LIMIT`` query, which the
+database answers with a scan of the category but without sending every
+id to the worker.
+"""
+import random
+from array import array
+
+from sqlalchemy import func, select
+
+from models import Question, db
+from .sessions import DECK_BATCH
+
+# Questions one quiz session can deal (4 bytes each in its deck)
+QUIZ_DECK_SIZE = 10000
+
+# Ids read per index probe while skipping seen questions
+SCAN_BATCH = 64
+
+
+def category_filter(category):
+    """WHERE clauses for a quiz category; None or 0 means every category."""
+    if category is None or str(category) == '0':
+        return []
+    return [Question.category == str(category)]
+
+
+def next_unseen(conditions, start, stop, seen):
+    """The smallest matching id in ``[start, stop]`` that is not in ``seen``."""
+    while start <= stop:
+        ids = db.session.execute(
+            select(Question.id)
+            .where(*conditions, Question.id >= start, Question.id <= stop)
+            .order_by(Question.id).limit(SCAN_BATCH)).scalars().all()
+        for question_id in ids:
+            if question_id not in seen:
+                return question_id
+        if len(ids) < SCAN_BATCH:
+            return None
+        start = ids[-1] + 1
+    return None
+
+
+def random_question(category=None, seen=frozenset(), rng=random):
+    """
+    A random question of ``category`` whose id is not in ``seen`` (any
+    container of ids), or None once every question has been seen.
+    """
+    conditions = category_filter(category)
+    # Two scalar subqueries, since some databases (SQLite) only read
+    # min() or max() from the index when it is alone in its query
+    low, high = db.session.execute(select(
+        select(func.min(Question.id)).where(*conditions).scalar_subquery(),
+        select(func.max(Question.id)).where(*conditions).scalar_subquery())).one()
+    if low is None:
+        return None
+
+    pivot = rng.randint(low, high)
+    question_id = next_unseen(conditions, pivot, high, seen)
+    if question_id is None:
+        question_id = next_unseen(conditions, low, pivot - 1, seen)
+    if question_id is None:
+        return None
+    row = db.session.execute(Question.select_rows().where(Question.id == question_id)).first()
+    return Question.format_row(row) if row is not None else None
+
+
+def shuffled_deck(category=None, size=QUIZ_DECK_SIZE, pools=None, rng=random):
+    """
+    Up to ``size`` random ids of questions in ``category``, shuffled, as an
+    ``array('i')``; from ``pools`` (QuizPools) when given.
+    """
+    if pools is not None:
+        return pools.deck(category, size, rng)
+    ids = array('i', db.session.execute(
+        select(Question.id).where(*category_filter(category))
+        .order_by(func.random()).limit(size)).scalars())
+    rng.shuffle(ids)
+    return ids
+
+
+def next_deck_question(store, session):
+    """
+    Deal the next question from ``session``'s deck, skipping ids of
+    questions deleted since the deck was shuffled; None once it is empty.
+    Advances the session but leaves storing it to the caller, with
+    ``store.advance(session, position_before)``.
+    """
+    while True:
+        ids = store.deck_ids(session, session.position, DECK_BATCH)
+        if not ids:
+            return None
+        for question_id in ids:
+            session.position += 1
+            row = db.session.execute(
+                Question.select_rows().where(Question.id == question_id)).first()
+            if row is not None:
+                session.asked += 1
+                return Question.format_row(row)
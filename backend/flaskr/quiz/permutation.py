@@ -0,0 +1,117 @@
+"""
+Stateless shuffled quizzes for POST /quizzes with ``seed`` and ``index``.
+
+The client holds only a seed and how far it has got. The seed freezes
+the category as it was when the quiz started: its largest question id
+and (rounded up to a power of four) how many questions it had. Each
+index is mapped through a keyed Feistel network, a bijection on
+``[0, 2**bits)``, to a position in the category's ids up to that
+largest id, in id order; the question at that position is dealt. So a
+quiz needs no server-side state and no ``NOT IN`` list, any worker can
+serve any step, and every request returns a question until the
+category is exhausted.
+
+At least a quarter of the permuted positions fall inside the category,
+so a request tries about four indexes (pure CPU) and resolves one
+position: from the worker's quiz pools when it has them, otherwise with
+an ``OFFSET`` query on the (category, id) index, which walks the index
+up to that position. Questions added after the quiz started are not
+dealt; deleting one mid-quiz shifts the positions after it, so a later
+question can be skipped or dealt twice.
+"""
+import hashlib
+import random
+
+from sqlalchemy import func, select
+
+from models import Question, QuestionCount, db
+from . import category_filter
+from .pools import pool_key
+
+FEISTEL_ROUNDS = 4
+# Indexes one request may try before answering "ask again"; only reached
+# once most of the category has been deleted mid-quiz
+PERMUTATION_SCAN = 4096
+BITS_MASK = 0x3F
+HIGH_BITS = 31
+HIGH_MASK = (1 << HIGH_BITS) - 1
+KEY_SHIFT = 6 + HIGH_BITS
+MAX_SEED = 1 << 62
+
+
+def feistel(index, key, bits, rounds=FEISTEL_ROUNDS):
+    """Permute ``index`` within ``[0, 2**bits)`` (``bits`` even) under ``key``."""
+    half = bits // 2
+    mask = (1 << half) - 1
+    left, right = index >> half, index & mask
+    for round_number in range(rounds):
+        digest = hashlib.blake2b(
+            f'{key}:{round_number}:{right}'.encode(), digest_size=8).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'little') & mask)
+    return (left << half) | right
+
+
+def new_seed(category, pools=None, rng=random):
+    """A random seed for a quiz over ``category`` as it is now."""
+    if pools is not None:
+        count, high = pools.extent(category)
+    else:
+        conditions = category_filter(category)
+        high = db.session.execute(select(func.max(Question.id)).where(*conditions)).scalar() or 0
+        count = QuestionCount.get(pool_key(category))
+    bits = max(2, count.bit_length())
+    bits += bits % 2
+    key = rng.randrange(MAX_SEED >> KEY_SHIFT)
+    return (key << KEY_SHIFT) | (min(high, HIGH_MASK) << 6) | bits
+
+
+def _count_up_to(category, high, pools):
+    if pools is not None:
+        return pools.count_up_to(category, high)
+    newer = db.session.execute(select(func.count()).select_from(Question).where(
+        *category_filter(category), Question.id > high)).scalar()
+    return QuestionCount.get(pool_key(category)) - newer
+
+
+def _question_at(category, high, position, pools):
+    if pools is not None:
+        question_id = pools.id_at(category, position)
+        if question_id is None or question_id > high:
+            return None
+        stmt = Question.select_rows().where(Question.id == question_id)
+    else:
+        stmt = (Question.select_rows()
+                .where(*category_filter(category), Question.id <= high)
+                .order_by(Question.id).offset(position).limit(1))
+    row = db.session.execute(stmt).first()
+    return Question.format_row(row) if row is not None else None
+
+
+def permuted_question(category, seed, index, pools=None):
+    """
+    Return ``(question, next_index, done)`` for the first question of
+    ``category`` at or after ``index`` in the order given by ``seed``.
+    ``question`` is None once the whole order has been walked (``done``
+    is True) or, only after mass deletions, when the scan budget ran out
+    first (``done`` is False; ask again from ``next_index``). Raises
+    ValueError for a malformed seed.
+    """
+    bits = seed & BITS_MASK
+    high = (seed >> 6) & HIGH_MASK
+    key = seed >> KEY_SHIFT
+    if bits < 2 or bits % 2 or index < 0 or not 0 <= seed < MAX_SEED:
+        raise ValueError(f'malformed quiz seed or index: {seed}, {index}')
+    size = 1 << bits
+    count = _count_up_to(category, high, pools)
+    if count <= 0:
+        return None, size, True
+
+    stop = min(index + PERMUTATION_SCAN, size)
+    while index < stop:
+        position = feistel(index, key, bits)
+        index += 1
+        if position < count:
+            question = _question_at(category, high, position, pools)
+            if question is not None:
+                return question, index, False
+    return None, index, index >= size
@@ -0,0 +1,113 @@
+"""
+Worker-local question id pools for POST /quizzes.
+
+Every category, and ALL, maps to a sorted ``array('i')`` of its question
+ids: 4 bytes per id, so 8 bytes per question counting both its category
+pool and the ALL pool (about 8 MB per million questions, plus array
+over-allocation). Picking a question is then a random index into the
+pool, retried while it lands on an already seen question; only when the
+player has seen most of the pool is the pool scanned for what's left.
+
+Pools follow every worker's question writes by replaying the change log
+(see QuestionMirror). They also deal the shuffled decks of quiz
+sessions, in time proportional to the deck rather than the category.
+"""
+import random
+from bisect import bisect_left, bisect_right, insort
+from array import array
+
+from ..versions import QuestionMirror
+
+ALL = 'all'
+# Random draws before falling back to a scan of the unseen questions
+POOL_SAMPLE_TRIES = 32
+
+
+class PoolState:
+
+    def __init__(self):
+        self.pools = {ALL: array('i')}
+
+
+def pool_key(category):
+    if category is None or str(category) == '0':
+        return ALL
+    return str(category)
+
+
+def _insert(ids, question_id):
+    if not ids or ids[-1] < question_id:
+        ids.append(question_id)
+    else:
+        insort(ids, question_id)
+
+
+def _delete(ids, question_id):
+    at = bisect_left(ids, question_id)
+    if at < len(ids) and ids[at] == question_id:
+        del ids[at]
+
+
+class QuizPools(QuestionMirror):
+
+    def new_state(self):
+        return PoolState()
+
+    def add(self, state, question):
+        _insert(state.pools[ALL], question['id'])
+        _insert(state.pools.setdefault(str(question['category']), array('i')), question['id'])
+
+    def remove(self, state, question):
+        _delete(state.pools[ALL], question['id'])
+        pool = state.pools.get(str(question['category']))
+        if pool is not None:
+            _delete(pool, question['id'])
+
+    def sample(self, category=None, seen=frozenset(), rng=random):
+        """A random question id of ``category`` not in ``seen``, or None if none is left."""
+        self.ensure_fresh()
+        with self._lock:
+            pool = self.state.pools.get(pool_key(category))
+            if not pool:
+                return None
+            for _ in range(POOL_SAMPLE_TRIES):
+                question_id = pool[rng.randrange(len(pool))]
+                if question_id not in seen:
+                    return question_id
+            unseen = [question_id for question_id in pool if question_id not in seen]
+        return rng.choice(unseen) if unseen else None
+
+    def deck(self, category=None, size=None, rng=random):
+        """Up to ``size`` distinct ids of ``category`` in random order, as an ``array('i')``."""
+        self.ensure_fresh()
+        with self._lock:
+            pool = self.state.pools.get(pool_key(category))
+            if not pool:
+                return array('i')
+            count = len(pool) if size is None else min(size, len(pool))
+            return array('i', (pool[at] for at in rng.sample(range(len(pool)), count)))
+
+    def extent(self, category=None):
+        """``(count, largest id)`` of ``category``'s pool; ``(0, 0)`` when empty."""
+        self.ensure_fresh()
+        with self._lock:
+            pool = self.state.pools.get(pool_key(category))
+            return (len(pool), pool[-1]) if pool else (0, 0)
+
+    def count_up_to(self, category, high):
+        """How many ids of ``category`` are at most ``high``."""
+        self.ensure_fresh()
+        with self._lock:
+            pool = self.state.pools.get(pool_key(category))
+            return bisect_right(pool, high) if pool else 0
+
+    def id_at(self, category, position):
+        """The id at ``position`` in ``category``'s pool (in id order), or None."""
+        with self._lock:
+            pool = self.state.pools.get(pool_key(category))
+            return pool[position] if pool and 0 <= position < len(pool) else None
+
+    def memory_bytes(self):
+        """Bytes held by the pools' id arrays."""
+        with self._lock:
+            return sum(pool.buffer_info()[1] * pool.itemsize for pool in self.state.pools.values())
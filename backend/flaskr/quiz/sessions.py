@@ -0,0 +1,248 @@
+"""
+Server-side quiz sessions for the /quizzes/sessions endpoints.
+
+Starting a session shuffles up to QUIZ_DECK_SIZE ids of questions in
+its category into a deck, an ``array('i')`` (4 bytes per question; see
+shuffled_deck()). Each step takes
+the next id from the deck and loads that one question by primary key,
+skipping ids whose question has been deleted since, so a step costs the
+same at the start and the end of a quiz and no exclusion query is ever
+run. Questions added after the session started are not in its deck.
+Sessions expire ``ttl`` seconds after their last use.
+
+Two stores share one small interface (create/get/deck_ids/save/advance/
+delete). A step stores its new position with advance(), a compare-and-set
+on the position it started from, so two concurrent steps of one session
+never deal the same question: the loser reloads and tries again.
+
+- MemoryQuizStore: per-worker LRU bounded by session count and by the
+  total bytes of the decks it holds; needs sticky sessions with several
+  workers.
+- SqlQuizStore: a ``quiz_sessions`` table in the app's database or in a
+  separate SQLite file, shared by every worker that can reach it. The
+  deck is stored once as raw bytes and each step reads only the slice
+  it needs. On PostgreSQL the table comes from migrations 005 and 006;
+  the latter stores decks uncompressed out of line (STORAGE EXTERNAL),
+  which is what lets substr() fetch a slice without detoasting the
+  whole deck.
+"""
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+from sqlalchemy import (
+    Column, Float, Integer, LargeBinary, MetaData, String, Table, create_engine, delete,
+    func, insert, select, update,
+)
+
+QUIZ_SESSION_TTL = 3600
+# A MemoryQuizStore drops its least recently used sessions past either bound
+QUIZ_SESSION_MAX = 10000
+QUIZ_SESSION_MAX_BYTES = 64 * 1024 * 1024
+# Deck ids read per store round trip; more than one only matters when
+# the next ids belong to deleted questions
+DECK_BATCH = 16
+
+
+class QuizSession:
+
+    def __init__(self, session_id, category=None, deck=None, position=0, asked=0):
+        self.id = session_id
+        self.category = category
+        # Only kept on the session by the memory store
+        self.deck = deck
+        self.position = position
+        self.asked = asked
+
+
+class MemoryQuizStore:
+    name = 'memory'
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX,
+                 max_bytes=QUIZ_SESSION_MAX_BYTES):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.deck_bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Least recently used first, which with one TTL is also the
+        # order sessions expire in
+        self._sessions = OrderedDict()
+
+    def _purge(self, now):
+        while self._sessions:
+            session_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id):
+        _, session = self._sessions.pop(session_id)
+        self.deck_bytes -= _deck_bytes(session)
+
+    def _store(self, session, now):
+        previous = self._sessions.get(session.id)
+        if previous is not None:
+            self.deck_bytes -= _deck_bytes(previous[1])
+        self._sessions[session.id] = (now + self.ttl, session)
+        self._sessions.move_to_end(session.id)
+        self.deck_bytes += _deck_bytes(session)
+        # The session just stored is kept even if its deck alone is over
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self.deck_bytes > self.max_bytes):
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def create(self, category, deck):
+        session = QuizSession(uuid.uuid4().hex, category, deck)
+        self.save(session)
+        return session
+
+    def deck_ids(self, session, start, count):
+        return session.deck[start:start + count]
+
+    def get(self, session_id):
+        with self._lock:
+            self._purge(time.monotonic())
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            # A copy, so a step in progress doesn't move the stored session
+            stored = item[1]
+            return QuizSession(stored.id, stored.category, stored.deck, stored.position, stored.asked)
+
+    def save(self, session):
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now)
+            self._store(session, now)
+
+    def advance(self, session, old_position):
+        """Store ``session``'s position and count if it is still at ``old_position``."""
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now)
+            item = self._sessions.get(session.id)
+            if item is None or item[1].position != old_position:
+                return False
+            self._store(session, now)
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+def _deck_bytes(session):
+    return len(session.deck) * session.deck.itemsize if session.deck is not None else 0
+
+
+metadata = MetaData()
+
+quiz_sessions = Table(
+    'quiz_sessions', metadata,
+    Column('id', String(32), primary_key=True),
+    Column('category', String),
+    Column('deck', LargeBinary, nullable=False),
+    Column('position', Integer, nullable=False, default=0),
+    Column('asked', Integer, nullable=False, default=0),
+    Column('expires_at', Float, nullable=False, index=True),
+)
+
+
+class SqlQuizStore:
+    """
+    Sessions in a ``quiz_sessions`` table reached through ``engine``, which
+    may be the app's own (PostgreSQL) engine or a separate SQLite one.
+    PostgreSQL gets the table from the migrations; other databases have
+    it created here. Expired rows are deleted whenever a session starts.
+    """
+    name = 'sql'
+
+    def __init__(self, engine, ttl=QUIZ_SESSION_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        if engine.dialect.name != 'postgresql':
+            metadata.create_all(engine)
+
+    @classmethod
+    def from_url(cls, url, ttl=QUIZ_SESSION_TTL):
+        return cls(create_engine(url), ttl)
+
+    def create(self, category, deck):
+        session = QuizSession(uuid.uuid4().hex, category)
+        with self.engine.begin() as connection:
+            connection.execute(delete(quiz_sessions).where(quiz_sessions.c.expires_at <= time.time()))
+            connection.execute(insert(quiz_sessions).values(
+                id=session.id, category=category, deck=deck.tobytes(), position=0, asked=0,
+                expires_at=time.time() + self.ttl))
+        return session
+
+    def deck_ids(self, session, start, count):
+        itemsize = array('i').itemsize
+        with self.engine.connect() as connection:
+            data = connection.execute(
+                select(func.substr(quiz_sessions.c.deck, start * itemsize + 1, count * itemsize))
+                .where(quiz_sessions.c.id == session.id)).scalar()
+        ids = array('i')
+        ids.frombytes(bytes(data or b''))
+        return ids
+
+    def get(self, session_id):
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(quiz_sessions.c.category, quiz_sessions.c.position, quiz_sessions.c.asked)
+                .where(quiz_sessions.c.id == session_id,
+                       quiz_sessions.c.expires_at > time.time())).first()
+        if row is None:
+            return None
+        return QuizSession(session_id, row.category, position=row.position, asked=row.asked)
+
+    def save(self, session):
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(quiz_sessions).where(quiz_sessions.c.id == session.id)
+                .values(position=session.position, asked=session.asked,
+                        expires_at=time.time() + self.ttl))
+
+    def advance(self, session, old_position):
+        """Store ``session``'s position and count if it is still at ``old_position``."""
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                update(quiz_sessions)
+                .where(quiz_sessions.c.id == session.id,
+                       quiz_sessions.c.position == old_position,
+                       quiz_sessions.c.expires_at > time.time())
+                .values(position=session.position, asked=session.asked,
+                        expires_at=time.time() + self.ttl))
+        return updated.rowcount == 1
+
+    def delete(self, session_id):
+        with self.engine.begin() as connection:
+            connection.execute(delete(quiz_sessions).where(quiz_sessions.c.id == session_id))
+
+
+def build_quiz_store(config, engine=None):
+    """
+    Create the store described by the QUIZ_SESSION* settings:
+    QUIZ_SESSIONS is 'memory' (default, capped at QUIZ_SESSION_MAX sessions
+    and QUIZ_SESSION_MAX_BYTES of decks), 'database' (the app's database, through ``engine``) or
+    'sqlite' (a file at QUIZ_SESSION_PATH).
+    """
+    kind = config.get('QUIZ_SESSIONS', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+    if kind == 'memory':
+        return MemoryQuizStore(ttl, config.get('QUIZ_SESSION_MAX', QUIZ_SESSION_MAX),
+                               config.get('QUIZ_SESSION_MAX_BYTES', QUIZ_SESSION_MAX_BYTES))
+    if kind == 'database':
+        return SqlQuizStore(engine, ttl)
+    if kind == 'sqlite':
+        return SqlQuizStore.from_url(f"sqlite:///{config['QUIZ_SESSION_PATH']}", ttl)
+    raise ValueError(f'unknown QUIZ_SESSIONS store: {kind!r}')
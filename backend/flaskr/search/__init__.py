@@ -0,0 +1,205 @@
+"""
+Search modes for the searchTerm branch of POST /questions.
+
+A request picks a mode with ``searchMode``. The SQL modes turn the term
+into a ``Question.select_rows()`` statement plus the ordering of its
+results:
+
+- ``substring`` (default): case-insensitive ``ilike '%term%'`` on the
+  question text, in id order.
+- ``fulltext``: PostgreSQL full-text search, ranked by ``ts_rank``.
+- ``fields``: full-text search over question, answer and category type
+  in one indexed query, ranked with a configurable weight per field.
+- ``trigram``: substring match on question or answer text through the
+  pg_trgm GIN indexes.
+- ``similar``: approximate (word-similarity) match through the same
+  indexes, best match first.
+
+The ``index`` mode instead asks the worker's in-memory InvertedIndex for
+a page of ids (BM25-ranked) and then loads just those rows.
+
+The ``fuzzy`` mode first corrects misspelled words against the known
+vocabulary (FuzzyVocabulary), then looks up the corrected words like
+``index`` (``OR`` and ``AND`` keep their meaning). It goes through the
+inverted index when the worker has one, otherwise through an ``ilike``
+query per word.
+
+Every mode takes optional ``category`` and ``difficulty`` filters and,
+with ``facets``, reports how the matches split by category and
+difficulty. Facets are disjunctive: category counts apply only the
+difficulty filter and difficulty counts only the category filter, so a
+UI can offer the other choices of each. They come from one GROUP BY
+query over at most FACET_SCAN_LIMIT matches (SQL modes; past that
+``facetsAreEstimate`` is true) or the same pass over the matches (index
+modes).
+
+With ``highlight``, each result also carries match offsets and a
+``<mark>``-ed snippet per field (see highlight.py).
+"""
+from flask import current_app
+from sqlalchemy import and_, or_, select, func
+
+from models import Question, db
+from ..pagination import paginate_questions, count_matches
+from .highlight import highlight_questions
+from .inverted import parse_query
+from .sql import (
+    substring_search, fulltext_search, fields_search, trigram_search, similar_search,
+)
+
+DEFAULT_SEARCH_MODE = 'substring'
+# Matches the facet GROUP BY looks at in SQL modes
+FACET_SCAN_LIMIT = 10000
+
+SEARCH_MODES = {
+    'substring': substring_search,
+    'fulltext': fulltext_search,
+    'fields': fields_search,
+    'trigram': trigram_search,
+    'similar': similar_search,
+}
+
+
+def search_statement(mode, term, options=None):
+    """
+    Return ``(stmt, order_by)`` for ``term`` in ``mode``; ``options`` is the
+    rest of the search payload. ``order_by`` is None for id order. Raises
+    ValueError for unknown or unusable modes and bad options.
+    """
+    try:
+        build = SEARCH_MODES[mode or DEFAULT_SEARCH_MODE]
+    except KeyError:
+        raise ValueError(f'unknown search mode: {mode!r}')
+    return build(term, options or {})
+
+
+def fetch_questions(ids):
+    """Load questions by id, keeping the order of ``ids``."""
+    if not ids:
+        return []
+    rows = db.session.execute(Question.select_rows().where(Question.id.in_(ids)))
+    by_id = {row.id: Question.format_row(row) for row in rows}
+    return [by_id[question_id] for question_id in ids if question_id in by_id]
+
+
+def search_filters(options):
+    """Read the ``category`` and ``difficulty`` filters of a search payload."""
+    filters = {}
+    try:
+        if options.get('category') not in (None, ''):
+            filters['category'] = str(int(options['category']))
+        if options.get('difficulty') not in (None, ''):
+            filters['difficulty'] = int(options['difficulty'])
+    except (TypeError, ValueError):
+        raise ValueError('category and difficulty filters must be integers')
+    return filters
+
+
+def filter_statement(stmt, filters):
+    if 'category' in filters:
+        stmt = stmt.where(Question.category == filters['category'])
+    if 'difficulty' in filters:
+        stmt = stmt.where(Question.difficulty == filters['difficulty'])
+    return stmt
+
+
+def facet_counts(stmt, filters):
+    """
+    Return ``(facets, estimated)``: per-category counts of ``stmt``'s rows
+    that pass the difficulty filter and per-difficulty counts of those
+    that pass the category filter, in one query. Only the first
+    FACET_SCAN_LIMIT rows are counted; ``estimated`` says the cap was hit.
+    """
+    matches = stmt.limit(FACET_SCAN_LIMIT).subquery()
+    rows = db.session.execute(
+        select(matches.c.category, matches.c.difficulty, func.count())
+        .group_by(matches.c.category, matches.c.difficulty))
+    facets = {'category': {}, 'difficulty': {}}
+    scanned = 0
+    for category, difficulty, n in rows:
+        scanned += n
+        category, difficulty = str(category), str(difficulty)
+        if str(filters.get('difficulty', difficulty)) == difficulty:
+            facets['category'][category] = facets['category'].get(category, 0) + n
+        if filters.get('category', category) == category:
+            facets['difficulty'][difficulty] = facets['difficulty'].get(difficulty, 0) + n
+    return facets, scanned >= FACET_SCAN_LIMIT
+
+
+def index_search(term, page, limit, filters, facets):
+    index = current_app.extensions.get('search_index')
+    if index is None:
+        raise ValueError("search mode 'index' is turned off (SEARCH_INDEX)")
+    ids, total, counts, estimated = index.search(
+        term, (max(page, 1) - 1) * limit, limit, filters=filters, facets=facets)
+    questions = fetch_questions(ids) if page >= 1 else []
+    return questions, total, estimated, counts
+
+
+def sql_search(stmt, order_by, page, limit, filters, facets):
+    filtered = filter_statement(stmt, filters)
+    questions, _ = paginate_questions(filtered, page, per_page=limit, order_by=order_by)
+    total, estimated = count_matches(filtered) if questions else (0, False)
+    counts, counts_estimated = facet_counts(stmt, filters) if facets else (None, False)
+    return questions, total, estimated, counts, counts_estimated
+
+
+def words_search(groups):
+    """
+    Every word of one of ``groups`` (parse_query() output) appears in the
+    question or answer text.
+    """
+    return Question.select_rows().where(or_(*(and_(*(
+        or_(Question.question.ilike(f'%{word}%'), Question.answer.ilike(f'%{word}%'))
+        for word in group)) for group in groups)))
+
+
+def run_search(mode, term, page, limit, options=None):
+    """
+    Return the response fields for one page of results: ``questions``,
+    ``totalQuestions``, ``totalIsEstimate`` and any extras (``facets`` with
+    ``facetsAreEstimate``, ``correctedTerm``); with ``highlight``, questions carry a ``highlight``
+    entry. Raises ValueError for unknown or unusable modes
+    and bad options.
+    """
+    options = options or {}
+    filters = search_filters(options)
+    facets = bool(options.get('facets'))
+    extras = {}
+    # Fuzzy searches without an inverted index look the words up in SQL
+    fuzzy_sql = False
+
+    if mode == 'fuzzy':
+        vocabulary = current_app.extensions.get('fuzzy_vocabulary')
+        if vocabulary is None:
+            raise ValueError("search mode 'fuzzy' is turned off (FUZZY_INDEX)")
+        term = extras['correctedTerm'] = vocabulary.correct_query(term)
+        if not parse_query(term):
+            raise ValueError('nothing to search for')
+        if 'search_index' in current_app.extensions:
+            mode = 'index'
+        else:
+            fuzzy_sql = True
+
+    if mode == 'index':
+        questions, total, estimated, counts = index_search(term, page, limit, filters, facets)
+        counts_estimated = estimated
+    else:
+        if fuzzy_sql:
+            stmt, order_by = words_search(parse_query(term)), None
+        else:
+            stmt, order_by = search_statement(mode, term, options)
+        questions, total, estimated, counts, counts_estimated = sql_search(
+            stmt, order_by, page, limit, filters, facets)
+
+    if options.get('highlight'):
+        questions = highlight_questions(questions, mode, term)
+    if facets:
+        extras['facets'] = counts
+        extras['facetsAreEstimate'] = counts_estimated
+    return {
+        'questions': questions,
+        'totalQuestions': total,
+        'totalIsEstimate': estimated,
+        **extras,
+    }
@@ -0,0 +1,147 @@
+"""
+Typo-tolerant search support: corrects misspelled query words to the
+nearest words that actually occur in question or answer text.
+
+Candidates come from a trigram index over the vocabulary (a word within
+edit distance d of the query shares all but at most 3*d of its padded
+trigrams); each candidate is then checked with a bounded Levenshtein
+distance. The closest word wins, ties going to the more common word.
+Swapping two adjacent letters counts as one edit.
+
+Words of up to SHORT_WORD_LENGTH letters have too few trigrams for that
+filter (``teh`` shares none with ``the``), so when it finds nothing they
+are compared with every known word of about the same length instead.
+
+The ``OR`` and ``AND`` operators of a query are passed through as they
+are.
+"""
+from ..versions import QuestionMirror
+from .inverted import tokenize
+
+SHORT_WORD_LENGTH = 4
+OPERATORS = ('OR', 'AND')
+
+
+def max_distance(word):
+    return 1 if len(word) <= SHORT_WORD_LENGTH else 2
+
+
+def trigrams(word):
+    padded = f'${word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a, b, limit):
+    """Edit distance between ``a`` and ``b``, or ``limit + 1`` once it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def edit_distance(a, b, limit):
+    """levenshtein(), except that one swap of adjacent letters costs 1."""
+    if len(a) == len(b):
+        diffs = [i for i, (x, y) in enumerate(zip(a, b)) if x != y]
+        if (len(diffs) == 2 and diffs[1] == diffs[0] + 1
+                and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]):
+            return 1
+    return levenshtein(a, b, limit)
+
+
+class FuzzyState:
+
+    def __init__(self):
+        self.term_counts = {}
+        self.grams = {}
+        # Short words by length, for the fallback trigrams can't serve
+        self.short_terms = {}
+
+
+class FuzzyVocabulary(QuestionMirror):
+
+    def new_state(self):
+        return FuzzyState()
+
+    def add(self, state, question):
+        for term in set(tokenize(question['question']) + tokenize(question['answer'])):
+            count = state.term_counts.get(term, 0)
+            if count == 0:
+                for gram in trigrams(term):
+                    state.grams.setdefault(gram, set()).add(term)
+                if len(term) <= SHORT_WORD_LENGTH + 1:
+                    state.short_terms.setdefault(len(term), set()).add(term)
+            state.term_counts[term] = count + 1
+
+    def remove(self, state, question):
+        for term in set(tokenize(question['question']) + tokenize(question['answer'])):
+            count = state.term_counts.get(term, 0) - 1
+            if count > 0:
+                state.term_counts[term] = count
+            elif count == 0:
+                del state.term_counts[term]
+                for gram in trigrams(term):
+                    terms = state.grams.get(gram)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del state.grams[gram]
+                short = state.short_terms.get(len(term))
+                if short is not None:
+                    short.discard(term)
+
+    def correct(self, word):
+        """The nearest known word to ``word`` (itself if known), or None."""
+        self.ensure_fresh()
+        word = word.lower()
+        with self._lock:
+            state = self.state
+            if word in state.term_counts:
+                return word
+            limit = max_distance(word)
+            query_grams = trigrams(word)
+            shared = {}
+            for gram in query_grams:
+                for term in state.grams.get(gram, ()):
+                    shared[term] = shared.get(term, 0) + 1
+
+            needed = len(query_grams) - 3 * limit
+            best = self._closest(
+                state, word, (term for term, count in shared.items() if count >= needed), limit)
+            if best is None and len(word) <= SHORT_WORD_LENGTH:
+                best = self._closest(state, word, (
+                    term for length in range(len(word) - limit, len(word) + limit + 1)
+                    for term in state.short_terms.get(length, ())), limit)
+            return best
+
+    @staticmethod
+    def _closest(state, word, candidates, limit):
+        best = None
+        for term in candidates:
+            distance = edit_distance(word, term, limit)
+            if distance <= limit:
+                rank = (distance, -state.term_counts[term], term)
+                if best is None or rank < best:
+                    best = rank
+        return best[2] if best else None
+
+    def correct_query(self, text):
+        """
+        Correct every word of ``text``; words with no close match are kept,
+        and so are the ``OR`` and ``AND`` operators.
+        """
+        words = []
+        for part in text.split():
+            if part in OPERATORS:
+                words.append(part)
+            else:
+                words.extend(self.correct(word) or word for word in tokenize(part))
+        return ' '.join(words)
@@ -0,0 +1,91 @@
+"""
+Match highlighting for search results (``highlight`` option).
+
+The query is compiled once per search into a single alternation of its
+words, and each result field is scanned with it once, so the cost does
+not grow with the number of terms. The scan stops after
+HIGHLIGHT_SCAN_CHARS characters and HIGHLIGHT_MAX_MARKS matches per
+field, which keeps a page of at most SEARCH_MAX_LIMIT results within a
+fixed budget however long the texts are.
+
+Each highlighted question gets a ``highlight`` entry per matching field:
+``offsets`` (``[start, end]`` character ranges in the field) and an
+HTML ``snippet`` of up to HIGHLIGHT_SNIPPET_CHARS characters with the
+matches wrapped in ``<mark>``.
+"""
+import html
+import re
+from itertools import islice
+
+from .inverted import TOKEN
+
+HIGHLIGHT_FIELDS = ('question', 'answer')
+HIGHLIGHT_SCAN_CHARS = 2000
+HIGHLIGHT_MAX_MARKS = 10
+HIGHLIGHT_SNIPPET_CHARS = 160
+# Context kept in front of the first match when a snippet is cut
+HIGHLIGHT_LEAD_CHARS = 40
+
+# Modes that match the term anywhere in the text rather than word by word
+SUBSTRING_MODES = (None, 'substring', 'trigram')
+
+
+def highlight_pattern(mode, term):
+    """
+    One compiled pattern for every part of ``term`` that can match:
+    the whole term for substring modes, otherwise each word as a word
+    prefix, which also covers ``penic*`` and full-text matches whose
+    stem only drops an ending. Words the stemmer respells (``studies``
+    for ``study``) match but are not marked.
+    """
+    if mode in SUBSTRING_MODES:
+        parts = [re.escape(term)] if term else []
+    else:
+        words = {word for part in term.split() if part not in ('OR', 'AND')
+                 for word in TOKEN.findall(part.lower())}
+        parts = [r'\b' + re.escape(word) + r'\w*' for word in sorted(words, key=len, reverse=True)]
+    if not parts:
+        return None
+    return re.compile('|'.join(parts), re.IGNORECASE)
+
+
+def highlight_text(pattern, text):
+    """Return ``{'offsets': ..., 'snippet': ...}`` for ``text``, or None without a match."""
+    offsets = [match.span() for match in islice(
+        pattern.finditer(text, 0, HIGHLIGHT_SCAN_CHARS), HIGHLIGHT_MAX_MARKS)]
+    if not offsets:
+        return None
+
+    start = 0
+    if len(text) > HIGHLIGHT_SNIPPET_CHARS:
+        start = max(0, min(offsets[0][0] - HIGHLIGHT_LEAD_CHARS, len(text) - HIGHLIGHT_SNIPPET_CHARS))
+    end = min(len(text), start + HIGHLIGHT_SNIPPET_CHARS)
+
+    parts = ['…'] if start else []
+    position = start
+    for mark_start, mark_end in offsets:
+        if mark_start >= end:
+            break
+        mark_end = min(mark_end, end)
+        parts.append(html.escape(text[position:mark_start]))
+        parts.append('<mark>' + html.escape(text[mark_start:mark_end]) + '</mark>')
+        position = mark_end
+    parts.append(html.escape(text[position:end]))
+    if end < len(text):
+        parts.append('…')
+    return {'offsets': [list(span) for span in offsets], 'snippet': ''.join(parts)}
+
+
+def highlight_questions(questions, mode, term):
+    """Copies of ``questions`` with a ``highlight`` entry for the fields ``term`` matched."""
+    pattern = highlight_pattern(mode, term)
+    highlighted = []
+    for question in questions:
+        fields = {}
+        if pattern is not None:
+            for field in HIGHLIGHT_FIELDS:
+                marks = highlight_text(pattern, question[field] or '')
+                if marks is not None:
+                    fields[field] = marks
+        highlighted.append({**question, 'highlight': fields})
+    return highlighted
@@ -0,0 +1,481 @@
+"""
+In-process inverted index over question and answer text, for the
+``index`` search mode on databases without full-text or trigram support.
+
+Each term maps to a posting list kept as two parallel arrays: sorted
+question ids (``array('i')``) and term frequencies (``array('H')``).
+Document lengths, categories and difficulties live in arrays indexed by
+question id, which lets filters and facet counts read them per match.
+Questions get increasing ids, so inserts are almost always appends.
+
+Queries are AND by default; ``OR`` (upper case) separates alternatives,
+so ``world cup OR olympics`` means ``(world AND cup) OR olympics``.
+Matches are ranked with BM25.
+
+A search never visits every match. Terms in LONG_TERM_DF or more
+questions also keep their postings in impact order (best BM25 term
+score first, as one ``array('q')`` of keys) and a histogram of their
+questions by (category, difficulty). The page is found by walking the
+query terms' impact lists side by side, looking the other terms of each
+question up by bisect, until the page's worst score beats the best score
+an unseen question could still reach (Fagin's threshold algorithm).
+Totals and facets of a one-word search come from its histogram; for AND
+groups of long terms they are estimated from COUNT_SAMPLE evenly spaced
+entries of the group's shortest posting list. In large banks, words in
+more than half of the questions are dropped from AND groups that have
+other words. Measured with benchmarks/bench_search.py --index-only on
+1,000,000 synthetic questions (median): ``title`` (171k matches)
+0.09 ms, ``world cup`` (25k matches) 0.84 ms, ``zzzz`` 0.005 ms. The
+first search of a long term builds its impact list (0.2-0.5 s there).
+
+BM25 normalizes document lengths by the average length frozen when the
+impact lists were built; they are rebuilt lazily once the live average
+drifts by AVERAGE_LENGTH_DRIFT. Searches read posting and impact arrays
+outside the lock, so writes replace a term's arrays instead of changing
+them in place (except appends, which add the tf before the id).
+"""
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+
+from ..versions import QuestionMirror
+
+TOKEN = re.compile(r'\w+')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms in at least this many questions keep an impact list and histogram
+LONG_TERM_DF = 256
+# Entries of an AND group's shortest posting list checked for its counts
+COUNT_SAMPLE = 256
+# Share of the questions past which a word no longer narrows an AND group
+STOP_TERM_SHARE = 0.5
+# ...applied only in banks of at least this many questions
+STOP_TERM_MIN_COUNT = 10000
+# Relative change of the average length that rebuilds the impact lists
+AVERAGE_LENGTH_DRIFT = 0.1
+
+# Impact keys: (IMPACT_MAX - quantized term score) << 32 | question id,
+# so ascending keys list the best scores first, lowest id first on ties
+IMPACT_MAX = (1 << 31) - 1
+IMPACT_STEP = (BM25_K1 + 1) / IMPACT_MAX
+ID_MASK = 0xFFFFFFFF
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def parse_query(text):
+    """Split a query into OR-ed groups of AND-ed terms."""
+    groups = [[]]
+    for word in text.split():
+        if word == 'OR':
+            groups.append([])
+        elif word != 'AND':
+            groups[-1].extend(tokenize(word))
+    return [group for group in groups if group]
+
+
+class IndexState:
+
+    def __init__(self):
+        self.postings = {}
+        self.impacts = {}
+        self.histograms = {}
+        self.average_length = None
+        self.doc_lengths = array('H')
+        self.doc_categories = array('i')
+        self.doc_difficulties = array('B')
+        self.doc_count = 0
+        self.total_length = 0
+
+
+class QueryTerm:
+    """One query term's arrays, taken under the lock and read outside it."""
+
+    def __init__(self, ids, tfs, impacts, histogram, weight):
+        self.ids = ids
+        self.tfs = tfs
+        self.impacts = impacts
+        self.histogram = histogram
+        self.weight = weight
+
+    def tf(self, doc_id):
+        at = bisect_left(self.ids, doc_id)
+        return self.tfs[at] if at < len(self.ids) and self.ids[at] == doc_id else 0
+
+
+def _category_number(category):
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return -1
+
+
+class InvertedIndex(QuestionMirror):
+
+    def new_state(self):
+        return IndexState()
+
+    def add(self, state, question):
+        terms = tokenize(question['question']) + tokenize(question['answer'])
+        doc_id = question['id']
+        if doc_id >= len(state.doc_lengths):
+            grow = doc_id + 1 - len(state.doc_lengths)
+            state.doc_lengths.extend([0] * grow)
+            state.doc_categories.extend([-1] * grow)
+            state.doc_difficulties.extend([0] * grow)
+        length = state.doc_lengths[doc_id] = min(len(terms), 0xFFFF)
+        state.doc_categories[doc_id] = _category_number(question['category'])
+        state.doc_difficulties[doc_id] = max(0, min(int(question['difficulty'] or 0), 0xFF))
+        state.doc_count += 1
+        state.total_length += len(terms)
+        cell = (state.doc_categories[doc_id], state.doc_difficulties[doc_id])
+
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, tf in frequencies.items():
+            tf = min(tf, 0xFFFF)
+            posting = state.postings.get(term)
+            if posting is None:
+                state.postings[term] = (array('i', [doc_id]), array('H', [tf]))
+            elif posting[0][-1] < doc_id:
+                posting[1].append(tf)
+                posting[0].append(doc_id)
+            else:
+                ids, tfs = posting[0][:], posting[1][:]
+                at = bisect_left(ids, doc_id)
+                ids.insert(at, doc_id)
+                tfs.insert(at, tf)
+                state.postings[term] = (ids, tfs)
+            if term in state.impacts:
+                self._update_long_term(state, term, tf, length, doc_id, cell, 1)
+
+    def remove(self, state, question):
+        terms = tokenize(question['question']) + tokenize(question['answer'])
+        doc_id = question['id']
+        length, cell = 0, None
+        if doc_id < len(state.doc_lengths):
+            length = state.doc_lengths[doc_id]
+            cell = (state.doc_categories[doc_id], state.doc_difficulties[doc_id])
+        for term in set(terms):
+            posting = state.postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            at = bisect_left(ids, doc_id)
+            if at < len(ids) and ids[at] == doc_id:
+                if term in state.impacts:
+                    self._update_long_term(state, term, tfs[at], length, doc_id, cell, -1)
+                if len(ids) == 1:
+                    del state.postings[term]
+                    state.impacts.pop(term, None)
+                    state.histograms.pop(term, None)
+                else:
+                    ids, tfs = ids[:], tfs[:]
+                    del ids[at]
+                    del tfs[at]
+                    state.postings[term] = (ids, tfs)
+        if doc_id < len(state.doc_lengths):
+            state.doc_lengths[doc_id] = 0
+        state.doc_count -= 1
+        state.total_length -= len(terms)
+
+    def finish(self, state):
+        if state.doc_count > 0:
+            state.average_length = state.total_length / state.doc_count
+
+    @staticmethod
+    def _update_long_term(state, term, tf, length, doc_id, cell, delta):
+        """Add (``delta`` 1) or remove (-1) one question in a long term's impact list and histogram."""
+        impacts = state.impacts[term][:]
+        key = _impact_key(tf, length, state.average_length, doc_id)
+        at = bisect_left(impacts, key)
+        if delta > 0:
+            impacts.insert(at, key)
+        elif at < len(impacts) and impacts[at] == key:
+            del impacts[at]
+        state.impacts[term] = impacts
+        histogram = dict(state.histograms[term])
+        histogram[cell] = histogram.get(cell, 0) + delta
+        if histogram[cell] <= 0:
+            del histogram[cell]
+        state.histograms[term] = histogram
+
+    @staticmethod
+    def _query_term(state, term, posting, average_length):
+        """A QueryTerm for ``term``, building its impact list and histogram if it is long."""
+        ids, tfs = posting
+        lengths = state.doc_lengths
+        impacts = state.impacts.get(term)
+        histogram = state.histograms.get(term)
+        if impacts is None:
+            impacts = array('q', sorted(
+                _impact_key(tf, lengths[doc_id], average_length, doc_id) for doc_id, tf in zip(ids, tfs)))
+            if len(ids) >= LONG_TERM_DF:
+                histogram = {}
+                categories, difficulties = state.doc_categories, state.doc_difficulties
+                for doc_id in ids:
+                    cell = (categories[doc_id], difficulties[doc_id])
+                    histogram[cell] = histogram.get(cell, 0) + 1
+                state.impacts[term] = impacts
+                state.histograms[term] = histogram
+        idf = math.log(1 + (state.doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+        return QueryTerm(ids, tfs, impacts, histogram, idf)
+
+    def search(self, text, offset=0, limit=10, filters=None, facets=False):
+        """
+        Return ``(ids, total, facet_counts, estimated)``: one page of
+        matching question ids, best BM25 score first, and the number of
+        matches after ``filters`` ({'category': ..., 'difficulty': ...}).
+        With ``facets``, ``facet_counts`` holds per-category counts of the
+        matches under the difficulty filter and per-difficulty counts under
+        the category filter; otherwise it is None. ``estimated`` says the
+        total and facets were scaled up from a sample.
+        """
+        self.ensure_fresh()
+        groups = parse_query(text)
+        no_match = [], 0, empty_facets() if facets else None, False
+        with self._lock:
+            state = self.state
+            if not groups or state.doc_count <= 0:
+                return no_match
+            average_length = state.total_length / state.doc_count
+            if (state.average_length is None
+                    or abs(average_length / state.average_length - 1) > AVERAGE_LENGTH_DRIFT):
+                state.average_length = average_length
+                state.impacts = {}
+                state.histograms = {}
+            average_length = state.average_length
+            terms = {}
+            for term in {term for group in groups for term in group}:
+                posting = state.postings.get(term)
+                if posting is not None:
+                    terms[term] = self._query_term(state, term, posting, average_length)
+            groups = _prune_groups(groups, terms, state.doc_count)
+        if not groups:
+            return no_match
+
+        filters = filters or {}
+        category = filters.get('category')
+        filters = (None if category is None else _category_number(category), filters.get('difficulty'))
+        top, complete, found, by_category, by_difficulty = _top_k(
+            state, groups, terms, average_length, filters, offset + limit)
+        ids = [-negative_id for _, negative_id in sorted(top, reverse=True)][offset:]
+        if complete:
+            total, estimated = found, False
+        else:
+            total, by_category, by_difficulty, estimated = _count(state, groups, terms, filters)
+            total = max(total, found)
+        facet_counts = None
+        if facets:
+            facet_counts = {
+                'category': {str(key): round(n) for key, n in sorted(by_category.items()) if round(n)},
+                'difficulty': {str(key): round(n) for key, n in sorted(by_difficulty.items()) if round(n)},
+            }
+        return ids, round(total), facet_counts, estimated
+
+
+def _prune_groups(groups, terms, doc_count):
+    """
+    Drop groups with a word no question has, and in large banks the words
+    of a group found in more than STOP_TERM_SHARE of the questions (keeping
+    its rarest word); one-word groups with a histogram come first.
+    """
+    common = doc_count * STOP_TERM_SHARE if doc_count >= STOP_TERM_MIN_COUNT else doc_count
+    pruned = []
+    for group in groups:
+        if any(term not in terms for term in group):
+            continue
+        words = sorted(set(group), key=lambda term: (len(terms[term].ids), term))
+        words = [term for term in words if len(terms[term].ids) <= common] or words[:1]
+        if words not in pruned:
+            pruned.append(words)
+    pruned.sort(key=lambda words: len(words) > 1 or terms[words[0]].histogram is None)
+    return pruned
+
+
+def _tally(by_category, by_difficulty, filters, category, difficulty, weight):
+    """Count one match (or ``weight`` of them) in the facets; True if it passes both filters."""
+    category_ok = filters[0] is None or category == filters[0]
+    difficulty_ok = filters[1] is None or difficulty == filters[1]
+    # Each facet counts the matches that pass the other filter
+    if difficulty_ok:
+        by_category[category] = by_category.get(category, 0) + weight
+    if category_ok:
+        by_difficulty[difficulty] = by_difficulty.get(difficulty, 0) + weight
+    return category_ok and difficulty_ok
+
+
+def _top_k(state, groups, terms, average_length, filters, k):
+    """
+    The ``k`` best matches passing ``filters`` as a heap of ``(score,
+    -id)``, with ``complete`` (every match was seen, so ``found`` and the
+    facet counts are exact).
+    """
+    # Rarest first, so a question missing a word is turned down soonest
+    order = sorted({term for group in groups for term in group}, key=lambda term: (len(terms[term].ids), term))
+    query_terms = [terms[term] for term in order]
+    slots = [[order.index(term) for term in group] for group in groups]
+    columns = [(term.ids, term.tfs) for term in query_terms]
+    weights = [term.weight for term in query_terms]
+    impacts = [term.impacts for term in query_terms]
+    sizes = [len(keys) for keys in impacts]
+    positions = [0] * len(order)
+    # The best score each list's next entry can add
+    bounds = [_bound(weight, keys, 0) for weight, keys in zip(weights, impacts)]
+    lengths, categories, difficulties = state.doc_lengths, state.doc_categories, state.doc_difficulties
+    category_filter, difficulty_filter = filters
+    by_category, by_difficulty = {}, {}
+    top = []
+    seen = set()
+    # Questions the filters turned down; looked up only if the facets
+    # end up exact
+    filtered_out = []
+    found = 0
+    complete = False
+    while True:
+        if complete:
+            for doc_id in filtered_out:
+                if _term_frequencies(columns, slots, doc_id) is not None:
+                    _tally(by_category, by_difficulty, filters, categories[doc_id], difficulties[doc_id], 1)
+            return top, True, found, by_category, by_difficulty
+        # A question not seen yet scores at most sum(bounds)
+        if len(top) >= k and (not k or top[0][0] >= sum(bounds)):
+            return top, False, found, by_category, by_difficulty
+        for slot, keys in enumerate(impacts):
+            position = positions[slot]
+            if position >= sizes[slot]:
+                continue
+            positions[slot] = position + 1
+            if position + 1 < sizes[slot]:
+                bounds[slot] = weights[slot] * (IMPACT_MAX - (keys[position + 1] >> 32)) * IMPACT_STEP
+            else:
+                bounds[slot] = 0.0
+                # Every match of a group is in each of its words' lists, so
+                # once one of them is used up the whole group has been seen
+                complete = all(any(positions[slot] >= sizes[slot] for slot in group) for group in slots)
+            doc_id = keys[position] & ID_MASK
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            category, difficulty = categories[doc_id], difficulties[doc_id]
+            if ((category_filter is not None and category != category_filter)
+                    or (difficulty_filter is not None and difficulty != difficulty_filter)):
+                filtered_out.append(doc_id)
+                continue
+            tfs = _term_frequencies(columns, slots, doc_id)
+            if tfs is None:
+                continue
+            _tally(by_category, by_difficulty, filters, category, difficulty, 1)
+            found += 1
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / average_length)
+            score = 0.0
+            for weight, tf in zip(weights, tfs):
+                if tf:
+                    score += weight * tf * (BM25_K1 + 1) / (tf + norm)
+            entry = (score, -doc_id)
+            if len(top) < k:
+                heapq.heappush(top, entry)
+            elif k and entry > top[0]:
+                heapq.heapreplace(top, entry)
+
+
+def _term_frequencies(columns, slots, doc_id):
+    """The question's tf of each query term, or None unless it matches one of the groups."""
+    tfs = []
+    for ids, term_tfs in columns:
+        at = bisect_left(ids, doc_id)
+        tf = term_tfs[at] if at < len(ids) and ids[at] == doc_id else 0
+        if not tf and len(slots) == 1:
+            return None
+        tfs.append(tf)
+    for group in slots:
+        for slot in group:
+            if not tfs[slot]:
+                break
+        else:
+            return tfs
+    return None
+
+
+def _bound(weight, keys, position):
+    if position >= len(keys):
+        return 0.0
+    return weight * (IMPACT_MAX - (keys[position] >> 32)) * IMPACT_STEP
+
+
+def _count(state, groups, terms, filters):
+    """
+    ``(total, by_category, by_difficulty, estimated)`` for the matches:
+    exact from the histogram of a leading one-word group and for groups
+    whose shortest list has at most COUNT_SAMPLE entries, otherwise
+    scaled up from COUNT_SAMPLE evenly spaced entries. Matches of earlier
+    groups are skipped, so OR-ed groups aren't counted twice.
+    """
+    categories, difficulties = state.doc_categories, state.doc_difficulties
+    cells = {}
+    estimated = False
+    for number, group in enumerate(groups):
+        if number == 0 and len(group) == 1 and terms[group[0]].histogram is not None:
+            cells = dict(terms[group[0]].histogram)
+            continue
+        ids = terms[group[0]].ids
+        others = [terms[term].ids for term in group[1:]]
+        earlier = [[terms[term].ids for term in words] for words in groups[:number]]
+        if len(ids) <= COUNT_SAMPLE:
+            sample, weight = ids, 1
+        else:
+            weight = len(ids) / COUNT_SAMPLE
+            sample = [ids[int(i * weight)] for i in range(COUNT_SAMPLE)]
+            estimated = True
+        # The sample is in id order, so each list is searched only past
+        # where the previous id was found
+        starts = [0] * len(others)
+        for doc_id in sample:
+            for slot, other in enumerate(others):
+                at = starts[slot] = bisect_left(other, doc_id, starts[slot])
+                if at == len(other) or other[at] != doc_id:
+                    break
+            else:
+                if earlier and _in_any(earlier, doc_id):
+                    continue
+                cell = (categories[doc_id], difficulties[doc_id])
+                cells[cell] = cells.get(cell, 0) + weight
+    by_category, by_difficulty = {}, {}
+    total = 0
+    for (category, difficulty), n in cells.items():
+        if _tally(by_category, by_difficulty, filters, category, difficulty, n):
+            total += n
+    return total, by_category, by_difficulty, estimated
+
+
+def empty_facets():
+    return {'category': {}, 'difficulty': {}}
+
+
+def _in_any(groups, doc_id):
+    """Whether every posting list of one of ``groups`` holds ``doc_id``."""
+    for lists in groups:
+        for ids in lists:
+            at = bisect_left(ids, doc_id)
+            if at == len(ids) or ids[at] != doc_id:
+                break
+        else:
+            return True
+    return False
+
+
+def _impact(tf, length, average_length):
+    """A term's BM25 score in one question, before its idf weight."""
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+    return tf * (BM25_K1 + 1) / (tf + norm)
+
+
+def _impact_key(tf, length, average_length, doc_id):
+    return (IMPACT_MAX - int(_impact(tf, length, average_length) / IMPACT_STEP)) << 32 | doc_id
@@ -0,0 +1,125 @@
+"""
+Worker-local LRU of search results for GET /questions/search.
+
+Entries are keyed on the normalized query (mode, words, page, limit,
+filters) together with the 'questions' data version, so a write anywhere
+makes every older entry unreachable; the cache drops them all as soon as
+it sees the stamp move. Popular searches are then answered from memory
+without touching the database or the index.
+
+The stamp can move before the worker's in-memory mirrors (search index,
+fuzzy vocabulary) have replayed that version. Results of a mode that
+reads mirrors are returned but not stored until each of them has synced
+at least the entry's version, so answers from a stale mirror never
+outlive the catch-up.
+"""
+import threading
+from collections import OrderedDict
+
+from . import DEFAULT_SEARCH_MODE, run_search
+from ..pagination import QUESTIONS_PER_PAGE
+
+SEARCH_CACHE_SIZE = 1024
+OPERATORS = ('OR', 'AND')
+
+
+def normalize_query(text):
+    """
+    Collapse whitespace and lower-case every word except the ``OR`` and
+    ``AND`` operators, so spellings that search the same share one entry.
+    """
+    return ' '.join(word if word in OPERATORS else word.lower() for word in text.split())
+
+
+def search_key(mode, term, page, limit, options):
+    """Cache key of one search, independent of how its options were spelled."""
+    return (
+        mode or DEFAULT_SEARCH_MODE,
+        term,
+        page,
+        limit,
+        str(options.get('category') or ''),
+        str(options.get('difficulty') or ''),
+        str(options.get('similarity') or ''),
+        str(options.get('weights') or ''),
+        bool(options.get('facets')),
+        bool(options.get('highlight')),
+    )
+
+
+class SearchResultCache:
+
+    def __init__(self, version, max_entries=SEARCH_CACHE_SIZE, mirrors=None):
+        self.version = version
+        self.max_entries = max_entries
+        # {mode: [QuestionMirror, ...]} for the modes that read mirrors
+        self.mirrors = mirrors or {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._entries_version = None
+
+    def get_or_search(self, key, search):
+        """Return the cached results for ``key``, calling ``search()`` on a miss."""
+        version = self.version.current()
+        with self._lock:
+            if version != self._entries_version:
+                self.evictions += len(self._entries)
+                self._entries.clear()
+                self._entries_version = version
+            results = self._entries.get((version, key))
+            if results is not None:
+                self._entries.move_to_end((version, key))
+                self.hits += 1
+                return results
+            self.misses += 1
+
+        results = search()
+        if self.max_entries > 0 and self._mirrors_synced(key[0], version):
+            with self._lock:
+                if version == self._entries_version:
+                    self._entries[(version, key)] = results
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+        return results
+
+    def _mirrors_synced(self, mode, version):
+        for mirror in self.mirrors.get(mode, ()):
+            synced = mirror.synced_version
+            if synced is None or synced < version:
+                return False
+        return True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'maxEntries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+
+def warm_search_cache(search_cache, terms, limit=QUESTIONS_PER_PAGE):
+    """
+    Fill ``search_cache`` with the first page of a default-mode search for
+    each of ``terms``, as ``GET /questions/search?q=<term>`` would. Returns
+    the normalized terms that were warmed; unusable ones are skipped.
+    """
+    warmed = []
+    for term in terms:
+        term = normalize_query(term)
+        if not term:
+            continue
+        key = search_key(None, term, 1, limit, {})
+        try:
+            search_cache.get_or_search(key, lambda: run_search(None, term, 1, limit))
+        except ValueError:
+            continue
+        warmed.append(term)
+    return warmed
@@ -0,0 +1,150 @@
+"""
+Search modes that run entirely in SQL.
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import REAL, cast, func, literal, literal_column, or_, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, array
+
+from models import Question, db
+
+# Maintained by migrations/001_question_search_vector.sql; not mapped on
+# the model because it only exists on PostgreSQL.
+search_vector = literal_column('questions.search_vector')
+# migrations/003_question_search_document.sql: question text, answer and
+# category type, weighted A, B and C.
+search_document = literal_column('questions.search_document')
+
+# How much a match in each field counts towards the rank, between 0 and 1.
+# Override with the SEARCH_FIELD_WEIGHTS setting or per search.
+DEFAULT_FIELD_WEIGHTS = {'question': 1.0, 'answer': 0.6, 'category': 0.3}
+
+WORD = re.compile(r'\w+')
+QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def require_postgresql(mode):
+    if db.session.connection().dialect.name != 'postgresql':
+        raise ValueError(f'search mode {mode!r} needs PostgreSQL')
+
+
+def require_pg_trgm(mode):
+    require_postgresql(mode)
+    installed = db.session.execute(
+        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+    if installed is None:
+        raise ValueError(f'search mode {mode!r} needs the pg_trgm extension')
+
+
+def substring_search(term, options):
+    return Question.select_rows().where(Question.question.ilike(f'%{term}%')), None
+
+
+def trigram_search(term, options):
+    """Substring match on question or answer text, served by the trigram GIN indexes."""
+    require_pg_trgm('trigram')
+    pattern = f'%{term}%'
+    stmt = Question.select_rows().where(
+        or_(Question.question.ilike(pattern), Question.answer.ilike(pattern)))
+    return stmt, None
+
+
+def similar_search(term, options):
+    """
+    Approximate match: ``term`` is similar to some run of words in the
+    question or answer. This uses pg_trgm's word-similarity operator
+    (``<%``) rather than plain ``%``, because the whole-string similarity
+    of a short term and a full question is always low. ``similarity`` in
+    the payload overrides the threshold (0.6 by default) for this
+    transaction only.
+    """
+    require_pg_trgm('similar')
+    threshold = options.get('similarity')
+    if threshold is not None:
+        threshold = float(threshold)
+        if not 0 < threshold <= 1:
+            raise ValueError(f'similarity must be in (0, 1], got {threshold}')
+        db.session.execute(
+            select(func.set_config('pg_trgm.word_similarity_threshold', str(threshold), True)))
+    stmt = Question.select_rows().where(or_(
+        literal(term).op('<%')(Question.question),
+        literal(term).op('<%')(Question.answer),
+    ))
+    score = func.greatest(func.word_similarity(term, Question.question),
+                          func.word_similarity(term, Question.answer))
+    return stmt, [score.desc(), Question.id]
+
+
+def to_tsquery_text(term):
+    """
+    Translate a user query into ``to_tsquery`` syntax. Every part must
+    match: ``"world cup"`` is a phrase (``world <-> cup``) and ``penic*``
+    a prefix (``penic:*``). Only word characters reach the tsquery, so
+    user input can't inject operators.
+    """
+    parts = []
+    for phrase, word in QUERY_PART.findall(term):
+        if phrase:
+            words = WORD.findall(phrase)
+            if words:
+                parts.append('(' + ' <-> '.join(words) + ')')
+            continue
+        words = WORD.findall(word)
+        if not words:
+            continue
+        if word.endswith('*'):
+            words[-1] += ':*'
+        parts.append(' & '.join(words))
+    return ' & '.join(parts)
+
+
+def fulltext_search(term, options):
+    require_postgresql('fulltext')
+    query_text = to_tsquery_text(term)
+    if not query_text:
+        raise ValueError(f'nothing to search for in {term!r}')
+    tsquery = func.to_tsquery('english', query_text)
+    stmt = Question.select_rows().where(search_vector.op('@@')(tsquery))
+    return stmt, [func.ts_rank(search_vector, tsquery).desc(), Question.id]
+
+
+def field_weights(options):
+    """
+    The field weights for one search: the app's SEARCH_FIELD_WEIGHTS,
+    overridden by ``weights`` in the search, given as a mapping or as
+    ``question:1,answer:0.5``.
+    """
+    weights = {**DEFAULT_FIELD_WEIGHTS, **current_app.config.get('SEARCH_FIELD_WEIGHTS', {})}
+    overrides = options.get('weights') or {}
+    try:
+        if isinstance(overrides, str):
+            overrides = dict(part.split(':', 1) for part in overrides.split(',') if part)
+        for field, weight in overrides.items():
+            if field not in DEFAULT_FIELD_WEIGHTS:
+                raise ValueError(f'unknown search field: {field!r}')
+            weights[field] = float(weight)
+    except (AttributeError, TypeError, ValueError) as error:
+        raise ValueError(f'bad search weights {overrides!r}: {error}')
+    if not all(0 <= weight <= 1 for weight in weights.values()):
+        raise ValueError(f'search weights must be between 0 and 1, got {weights}')
+    return weights
+
+
+def fields_search(term, options):
+    """
+    Full-text search over question, answer and category type at once,
+    through the single GIN index on ``search_document``. ``ts_rank``
+    weighs each match by the field (label) it came from.
+    """
+    require_postgresql('fields')
+    query_text = to_tsquery_text(term)
+    if not query_text:
+        raise ValueError(f'nothing to search for in {term!r}')
+    weights = field_weights(options)
+    # ts_rank takes the label weights in {D, C, B, A} order
+    labels = cast(array([0.0, weights['category'], weights['answer'], weights['question']]),
+                  ARRAY(REAL))
+    tsquery = func.to_tsquery('english', query_text)
+    stmt = Question.select_rows().where(search_document.op('@@')(tsquery))
+    return stmt, [func.ts_rank(labels, search_document, tsquery).desc(), Question.id]
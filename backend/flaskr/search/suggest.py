@@ -0,0 +1,100 @@
+"""
+Prefix index behind GET /questions/suggest.
+
+Two sorted arrays answer a prefix with a bisect range:
+
+- ``terms``: every distinct word of the question and answer text, with
+  the number of questions using it; suggestions are the most used terms
+  in the range.
+- ``titles``: lower-cased question texts, so typing the start of a
+  question ("who disc") suggests it.
+
+Short prefixes cover wide ranges, so answers are memoized per prefix
+until the next write.
+"""
+import heapq
+from bisect import bisect_left, insort
+
+from ..versions import QuestionMirror
+from .inverted import tokenize
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_MEMO_SIZE = 10000
+
+
+class SuggestState:
+
+    def __init__(self):
+        self.terms = []
+        self.term_counts = {}
+        self.titles = []
+        self.memo = {}
+        # While build() loads rows, append and sort once in finish()
+        self.loading = True
+
+
+def prefix_range(items, prefix):
+    # '\U0010ffff' sorts after any character a key can continue with
+    return bisect_left(items, prefix), bisect_left(items, prefix + '\U0010ffff')
+
+
+class SuggestIndex(QuestionMirror):
+
+    def new_state(self):
+        return SuggestState()
+
+    def add(self, state, question):
+        title = (question['question'].lower(), question['id'], question['question'])
+        for term in set(tokenize(question['question']) + tokenize(question['answer'])):
+            count = state.term_counts.get(term, 0)
+            if count == 0 and not state.loading:
+                insort(state.terms, term)
+            state.term_counts[term] = count + 1
+        if state.loading:
+            state.titles.append(title)
+        else:
+            insort(state.titles, title)
+            state.memo.clear()
+
+    def finish(self, state):
+        state.terms = sorted(state.term_counts)
+        state.titles.sort()
+        state.loading = False
+
+    def remove(self, state, question):
+        for term in set(tokenize(question['question']) + tokenize(question['answer'])):
+            count = state.term_counts.get(term, 0) - 1
+            if count > 0:
+                state.term_counts[term] = count
+            elif count == 0:
+                del state.term_counts[term]
+                del state.terms[bisect_left(state.terms, term)]
+        key = (question['question'].lower(), question['id'], question['question'])
+        at = bisect_left(state.titles, key)
+        if at < len(state.titles) and state.titles[at] == key:
+            del state.titles[at]
+        state.memo.clear()
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """Return ``(terms, questions)`` starting with ``prefix``."""
+        self.ensure_fresh()
+        prefix = prefix.lower()
+        with self._lock:
+            state = self.state
+            cached = state.memo.get((prefix, limit))
+            if cached is not None:
+                return cached
+
+            lo, hi = prefix_range(state.terms, prefix)
+            terms = heapq.nlargest(limit, state.terms[lo:hi], key=state.term_counts.__getitem__)
+
+            lo = bisect_left(state.titles, (prefix,))
+            hi = bisect_left(state.titles, (prefix + '\U0010ffff',))
+            questions = [{'id': question_id, 'question': text}
+                         for _, question_id, text in state.titles[lo:min(hi, lo + limit)]]
+
+            if len(state.memo) >= SUGGEST_MEMO_SIZE:
+                state.memo.clear()
+            state.memo[(prefix, limit)] = (terms, questions)
+            return terms, questions
@@ -0,0 +1,89 @@
+"""
+Popular-search tracking in fixed memory.
+
+Every search term (normalized like the result cache keys) is counted in
+a Count-Min sketch: ``depth`` rows of ``width`` counters, one counter
+per row picked by hashing the term. A term's estimate is the smallest
+of its counters; collisions only ever add, so it can overcount but
+never undercount. Next to the sketch, a min-heap keeps the ``k`` terms
+with the highest estimates seen so far. Memory stays the same however
+many distinct terms arrive. Counts are per worker.
+"""
+import hashlib
+import heapq
+import threading
+from array import array
+
+SEARCH_TOP_K = 20
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+
+
+class CountMinSketch:
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.rows = [array('I', bytes(4 * width)) for _ in range(depth)]
+
+    def _cells(self, item):
+        # One 64-bit digest split into two hashes gives every row its own
+        # independent-enough cell (h1 + i * h2), with a single hash call
+        digest = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'little')
+        h1, h2 = digest & 0xFFFFFFFF, (digest >> 32) | 1
+        return [(row, (h1 + i * h2) % self.width) for i, row in enumerate(self.rows)]
+
+    def add(self, item, count=1):
+        """Count ``item`` and return its new estimate."""
+        estimate = None
+        for row, cell in self._cells(item):
+            row[cell] = min(row[cell] + count, 0xFFFFFFFF)
+            estimate = row[cell] if estimate is None else min(estimate, row[cell])
+        return estimate
+
+    def estimate(self, item):
+        return min(row[cell] for row, cell in self._cells(item))
+
+
+class SearchTelemetry:
+
+    def __init__(self, k=SEARCH_TOP_K, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.k = k
+        self.searches = 0
+        self.sketch = CountMinSketch(width, depth)
+        self._lock = threading.Lock()
+        self._top = {}
+        # (estimate, term) pairs; entries whose estimate has since moved
+        # on are skipped when they reach the top of the heap
+        self._heap = []
+
+    def record(self, term):
+        if not term or self.k < 1:
+            return
+        with self._lock:
+            self.searches += 1
+            estimate = self.sketch.add(term)
+            if term not in self._top:
+                if len(self._top) >= self.k:
+                    smallest, smallest_term = self._smallest()
+                    if estimate <= smallest:
+                        return
+                    heapq.heappop(self._heap)
+                    del self._top[smallest_term]
+            self._top[term] = estimate
+            heapq.heappush(self._heap, (estimate, term))
+            if len(self._heap) > 4 * self.k:
+                self._heap = [(count, term) for term, count in self._top.items()]
+                heapq.heapify(self._heap)
+
+    def _smallest(self):
+        while True:
+            count, term = self._heap[0]
+            if self._top.get(term) == count:
+                return count, term
+            heapq.heappop(self._heap)
+
+    def top(self, n=None):
+        """The most searched terms, most searched first, as (term, estimate) pairs."""
+        with self._lock:
+            ranked = sorted(self._top.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:n]
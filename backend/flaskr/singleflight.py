@@ -0,0 +1,75 @@
+"""
+Single-flight coalescing for identical concurrent reads.
+
+When a popular page misses the response cache, every request for it would
+otherwise run the same queries at once. SingleFlight lets the first
+request (the leader) compute the response while identical requests that
+arrive meanwhile wait for it and reuse the result. Coalescing is per
+worker process, across its threads.
+
+Waiters get their own Response built from the leader's status, mimetype
+and body, since after_request handlers modify the response object.
+"""
+import threading
+from functools import wraps
+
+from flask import make_response
+
+from .cache import request_key
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run ``fn()`` once for all concurrent callers with the same ``key``."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def coalesce(self, view):
+        """Decorate a GET view so identical concurrent requests share one run."""
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            def run():
+                response = make_response(view(*args, **kwargs))
+                return response.status_code, response.mimetype, response.get_data()
+
+            status, mimetype, body = self.do(request_key(), run)
+            response = make_response(body, status)
+            response.mimetype = mimetype
+            return response
+        return wrapped
@@ -0,0 +1,181 @@
+"""
+Worker-local readings of DataVersion stamps.
+
+A VersionStamp re-reads its stamp at most once per ``check_interval``
+seconds, which is how writes made by other workers show up, and forgets
+its reading at once when this worker commits a write that bumps the
+stamp. A VersionedValue also holds something derived from the database
+(such as the category map) and reloads it only when the stamp moves.
+A QuestionMirror keeps a larger derived structure in step row by row,
+replaying the QuestionChange log.
+"""
+import threading
+import time
+
+from sqlalchemy import select
+
+from models import DataVersion, Question, QuestionChange, db
+
+DATA_VERSION_CHECK_INTERVAL = 1.0
+# Logged changes a mirror replays in one go before it rebuilds instead
+MIRROR_REPLAY_LIMIT = 5000
+
+
+class VersionStamp:
+
+    def __init__(self, name, check_interval=DATA_VERSION_CHECK_INTERVAL):
+        self.name = name
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = float('-inf')
+        DataVersion.subscribe(name, self.invalidate)
+
+    def invalidate(self):
+        self._checked_at = float('-inf')
+
+    def current(self):
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._version
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                version = DataVersion.get(self.name)
+                if version != self._version:
+                    self.changed(version)
+                    self._version = version
+                self._checked_at = time.monotonic()
+            return self._version
+
+    def changed(self, version):
+        """Called under the lock when a new stamp is read."""
+
+
+class VersionedValue(VersionStamp):
+
+    def __init__(self, name, loader, check_interval=DATA_VERSION_CHECK_INTERVAL):
+        self.loader = loader
+        self._value = None
+        super().__init__(name, check_interval)
+
+    def changed(self, version):
+        self._value = self.loader()
+
+    def get(self):
+        self.current()
+        return self._value
+
+
+class QuestionMirror:
+    """
+    Base for worker-local structures derived from every question (search
+    indexes, quiz pools). Subclasses implement ``new_state()``,
+    ``add(state, question)`` and ``remove(state, question)``, where
+    ``question`` is a Question.format() dict.
+
+    build() loads the whole table into a fresh state, calls
+    ``finish(state)`` and swaps it in. After that, ensure_fresh() reads
+    the 'questions' stamp at most once per ``check_interval`` (and right
+    after this worker commits a question write) and replays the
+    QuestionChange rows logged since the synced version, in order, so
+    every worker applies every write in place. A bulk statement, a log
+    gap past QuestionChange.RETENTION or more than MIRROR_REPLAY_LIMIT
+    changes instead start a rebuild in a background thread, serving the
+    old state until the new one is ready.
+    """
+
+    def __init__(self, app, check_interval=DATA_VERSION_CHECK_INTERVAL):
+        self.app = app
+        self.check_interval = check_interval
+        self.state = None
+        self._lock = threading.RLock()
+        self._synced_version = None
+        self._checked_at = float('-inf')
+        self._rebuilding = False
+        DataVersion.subscribe('questions', self.invalidate)
+
+    @property
+    def synced_version(self):
+        """The 'questions' version the state reflects; None while a rebuild is due."""
+        return self._synced_version
+
+    def invalidate(self):
+        self._checked_at = float('-inf')
+
+    def new_state(self):
+        raise NotImplementedError
+
+    def add(self, state, question):
+        raise NotImplementedError
+
+    def remove(self, state, question):
+        raise NotImplementedError
+
+    def finish(self, state):
+        """Called once build() has added every question; override to finalize bulk loads."""
+
+    def build(self):
+        """Load every question into a new state (needs an app context)."""
+        version = DataVersion.get('questions')
+        state = self.new_state()
+        # The stamp rides along in the same statement, so it matches the
+        # rows exactly and replaying from it never applies a write twice
+        stamp = select(DataVersion.version).where(DataVersion.name == 'questions').scalar_subquery()
+        rows = db.session.execute(
+            Question.select_rows().add_columns(stamp).execution_options(yield_per=10000))
+        for row in rows:
+            self.add(state, Question.format_row(row))
+            version = row[-1] or 0
+        self.finish(state)
+        with self._lock:
+            self.state = state
+            self._synced_version = version
+            self._checked_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self.state is None:
+            self.build()
+            return
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            self._checked_at = time.monotonic()
+            if self._synced_version is not None and self._replay():
+                return
+            self._synced_version = None
+        self._start_rebuild()
+
+    def _replay(self):
+        """Apply the changes logged since the synced version; False when only a rebuild will do."""
+        synced = self._synced_version
+        version = DataVersion.get('questions')
+        if version == synced:
+            return True
+        if not synced < version <= synced + QuestionChange.RETENTION:
+            return False
+        changes = QuestionChange.since(synced, version, MIRROR_REPLAY_LIMIT + 1)
+        if len(changes) > MIRROR_REPLAY_LIMIT or (None, None) in changes:
+            return False
+        for old, new in changes:
+            if old is not None:
+                self.remove(self.state, old)
+            if new is not None:
+                self.add(self.state, new)
+        self._synced_version = version
+        return True
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                with self.app.app_context():
+                    self.build()
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, daemon=True).start()
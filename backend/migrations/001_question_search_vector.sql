@@ -0,0 +1,10 @@
+-- Full-text search over question text.
+-- A generated column is filled for every existing row when it is added
+-- (the backfill) and kept up to date by PostgreSQL on every write.
+-- Needs PostgreSQL 12+.
+ALTER TABLE questions
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(question, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS questions_search_vector_idx
+    ON questions USING GIN (search_vector);
@@ -0,0 +1,23 @@
+-- Optional trigram indexes so substring (ILIKE '%term%') and similarity
+-- searches on question and answer text become index scans.
+-- pg_trgm ships with PostgreSQL but creating it may need extra
+-- privileges; without it this migration does nothing and the trigram
+-- search modes report that they are unavailable.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN insufficient_privilege OR undefined_file THEN
+    RAISE NOTICE 'pg_trgm is not available, skipping trigram indexes';
+END
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS questions_question_trgm_idx
+            ON questions USING GIN (question gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS questions_answer_trgm_idx
+            ON questions USING GIN (answer gin_trgm_ops);
+    END IF;
+END
+$$;
@@ -0,0 +1,51 @@
+-- Weighted full-text document for searchMode=fields: question text (A),
+-- answer (B) and the category type (C) in one GIN-indexed column.
+-- The category type lives in another table, which a generated column
+-- can't read, so triggers on both tables keep it current instead.
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_document tsvector;
+
+CREATE OR REPLACE FUNCTION question_search_document(question text, answer text, category text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('english', coalesce(question, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(answer, '')), 'B')
+        || setweight(to_tsvector('english', coalesce(
+               (SELECT type FROM categories WHERE id::text = category), '')), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION questions_search_document_trigger()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_document := question_search_document(NEW.question, NEW.answer, NEW.category::text);
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS questions_search_document ON questions;
+CREATE TRIGGER questions_search_document
+    BEFORE INSERT OR UPDATE OF question, answer, category ON questions
+    FOR EACH ROW EXECUTE FUNCTION questions_search_document_trigger();
+
+-- Renaming, adding or removing a category re-weights its questions
+CREATE OR REPLACE FUNCTION categories_search_document_trigger()
+RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    category_id text := CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END::text;
+BEGIN
+    UPDATE questions
+       SET search_document = question_search_document(question, answer, category::text)
+     WHERE category::text = category_id;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS categories_search_document ON categories;
+CREATE TRIGGER categories_search_document
+    AFTER INSERT OR DELETE OR UPDATE OF type ON categories
+    FOR EACH ROW EXECUTE FUNCTION categories_search_document_trigger();
+
+-- Backfill
+UPDATE questions
+   SET search_document = question_search_document(question, answer, category::text);
+
+CREATE INDEX IF NOT EXISTS questions_search_document_idx
+    ON questions USING GIN (search_document);
@@ -0,0 +1,4 @@
+-- Range scans within one category: the category question list and the
+-- random pivot lookups of POST /quizzes. New databases get it from the
+-- model through db.create_all().
+CREATE INDEX IF NOT EXISTS questions_category_id_idx ON questions (category, id);
@@ -0,0 +1,13 @@
+-- Server-side quiz sessions (QUIZ_SESSIONS = 'database'); mirrors the
+-- quiz_sessions table in flaskr/quiz/sessions.py. The deck is the raw
+-- bytes of an array('i') of question ids.
+CREATE TABLE IF NOT EXISTS quiz_sessions (
+    id varchar(32) PRIMARY KEY,
+    category varchar,
+    deck bytea NOT NULL,
+    position integer NOT NULL DEFAULT 0,
+    asked integer NOT NULL DEFAULT 0,
+    expires_at double precision NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_quiz_sessions_expires_at ON quiz_sessions (expires_at);
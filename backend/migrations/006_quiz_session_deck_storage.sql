@@ -0,0 +1,4 @@
+-- Keep quiz decks out of line and uncompressed, so the substr() that
+-- SqlQuizStore.deck_ids() runs per step reads only the chunks holding
+-- its slice instead of detoasting the whole deck.
+ALTER TABLE quiz_sessions ALTER COLUMN deck SET STORAGE EXTERNAL;
@@ -1,8 +1,12 @@
-from sqlalchemy import Column, String, Integer
+from collections import Counter, defaultdict
+from sqlalchemy import Column, String, Integer, Index, JSON, event, func, inspect, select, insert, update, delete
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
 from flask_sqlalchemy import SQLAlchemy
 # Load environment variables from .env file
 from dotenv import load_dotenv
 import os
+import weakref
 
 load_dotenv()  # ensures variables from .env are available
 # Get database credentials from environment variables
@@ -24,11 +28,37 @@ def setup_db(app, database_path=database_path):
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+"""
+apply_migrations()
+    runs the PostgreSQL-only schema changes in migrations/*.sql that
+    db.create_all() can't express (generated columns, GIN indexes,
+    extensions), in file-name order, each one once per database
+"""
+def apply_migrations():
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS schema_migrations (name text PRIMARY KEY)')
+    # Serialize workers starting at the same time
+    connection.exec_driver_sql('LOCK TABLE schema_migrations IN EXCLUSIVE MODE')
+    applied = {row[0] for row in connection.exec_driver_sql('SELECT name FROM schema_migrations')}
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if name.endswith('.sql') and name not in applied:
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                connection.exec_driver_sql(f.read())
+            connection.exec_driver_sql(
+                'INSERT INTO schema_migrations (name) VALUES (%(name)s)', {'name': name})
+    db.session.commit()
+
 """
 Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (Index('questions_category_id_idx', 'category', 'id'),)
 
     id = Column(Integer, primary_key=True)
     question = Column(String, nullable=False)
@@ -62,6 +92,21 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+    FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+    @classmethod
+    def select_rows(cls):
+        """
+        SELECT of just the formatted columns. It returns plain rows that skip
+        instance construction and the identity map; turn them into response
+        dicts with format_row().
+        """
+        return select(*(getattr(cls, field) for field in cls.FIELDS))
+
+    @classmethod
+    def format_row(cls, row):
+        return dict(zip(cls.FIELDS, row))
+
 """
 Category
 """
@@ -79,3 +124,304 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+def increment(connection, key_column, value_column, key, delta):
+    """Add ``delta`` to the counter row ``key``, creating it if needed."""
+    table = key_column.table
+    if connection.dialect.name == 'postgresql':
+        stmt = postgresql.insert(table).values({key_column.name: key, value_column.name: delta})
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[key_column],
+            set_={value_column.name: value_column + stmt.excluded[value_column.name]}))
+        return
+    updated = connection.execute(
+        update(table).where(key_column == key).values({value_column.name: value_column + delta}))
+    if updated.rowcount == 0:
+        connection.execute(insert(table).values({key_column.name: key, value_column.name: delta}))
+
+"""
+QuestionCount
+    maintained question totals: one row per category plus an 'all' row.
+    Kept in step with every question write (see the session hooks below)
+    so list endpoints read totals with a primary-key lookup instead of
+    COUNT(*).
+"""
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    ALL = 'all'
+
+    category = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    @classmethod
+    def get(cls, category=ALL):
+        count = db.session.execute(
+            select(cls.count).where(cls.category == str(category))).scalar()
+        return count or 0
+
+    @classmethod
+    def by_category(cls):
+        rows = db.session.execute(select(cls.category, cls.count).where(cls.category != cls.ALL))
+        return {category: count for category, count in rows}
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """Recompute every counter from the questions table (used after bulk loads)."""
+        connection = connection or db.session.connection()
+        totals = connection.execute(
+            select(Question.category, func.count(Question.id)).group_by(Question.category)
+        ).all()
+        rows = [{'category': str(category), 'count': n} for category, n in totals]
+        rows.append({'category': cls.ALL, 'count': sum(n for _, n in totals)})
+        connection.execute(delete(cls))
+        connection.execute(insert(cls), rows)
+
+    @classmethod
+    def ensure_built(cls):
+        if db.session.get(cls, cls.ALL) is None:
+            cls.rebuild()
+            db.session.commit()
+
+    @classmethod
+    def apply(cls, connection, deltas):
+        """Add ``deltas`` ({category: change}) to the counters in the current transaction."""
+        for category, delta in deltas.items():
+            if delta:
+                increment(connection, cls.category, cls.count, category, delta)
+
+"""
+DataVersion
+    a stamp per data set (e.g. 'categories') that moves on every write to
+    it, in the writing transaction. Worker-local caches compare stamps to
+    find out that another worker changed the data; within a worker,
+    subscribers are told right after the commit.
+
+    Besides the stamp names, a commit also reports finer write tags such
+    as 'questions:list' or 'category:3' (see question_tags()), which
+    tag-aware caches use to drop just the entries that changed.
+"""
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+    _subscribers = defaultdict(list)
+    _write_subscribers = []
+
+    @classmethod
+    def get(cls, name):
+        version = db.session.execute(select(cls.version).where(cls.name == name)).scalar()
+        return version or 0
+
+    @classmethod
+    def bump(cls, session, connection, names):
+        """
+        Move each stamp in ``names`` once per transaction, however many
+        flushes it has. The new numbers are kept in
+        ``session.info['bumped_versions']`` until the transaction ends.
+        """
+        bumped = session.info.setdefault('bumped_versions', {})
+        for name in set(names) - set(bumped):
+            increment(connection, cls.name, cls.version, name, 1)
+            bumped[name] = connection.execute(
+                select(cls.version).where(cls.name == name)).scalar()
+        cls.tag_writes(session, names)
+
+    @classmethod
+    def tag_writes(cls, session, tags):
+        """Remember ``tags`` so subscribers hear about them when ``session`` commits."""
+        session.info.setdefault('written_tags', set()).update(tags)
+
+    @classmethod
+    def subscribe(cls, name, callback):
+        """Call ``callback()`` after any local commit that bumps ``name``."""
+        cls._subscribers[name].append(_weak(callback))
+
+    @classmethod
+    def subscribe_writes(cls, callback):
+        """Call ``callback(tags)`` after every local commit that wrote tracked data."""
+        cls._write_subscribers.append(_weak(callback))
+
+    @classmethod
+    def notify(cls, tags):
+        for name in tags:
+            cls._subscribers[name] = _call_live(cls._subscribers[name])
+        cls._write_subscribers = _call_live(cls._write_subscribers, tags)
+
+"""
+QuestionChange
+    log of question writes in commit order, which workers replay into
+    their in-memory mirrors instead of reloading every question. Each row
+    holds the 'questions' version its transaction moved the stamp to and
+    the question before and after the write (Question.format() dicts;
+    ``old`` is None for inserts, ``new`` for deletes). A row with neither
+    marks a bulk statement whose rows aren't known.
+
+    Writers log their changes while holding the 'questions' stamp's row
+    lock, so rows of one version never interleave with another's. Rows
+    more than RETENTION versions old are trimmed every TRIM_EVERY versions.
+"""
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+
+    RETENTION = 10000
+    TRIM_EVERY = 1000
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    old = Column(JSON)
+    new = Column(JSON)
+
+    @classmethod
+    def record(cls, session, connection, changes):
+        """Log ``changes`` ((old, new) pairs, or None for a bulk statement) under this transaction's version."""
+        version = session.info['bumped_versions']['questions']
+        connection.execute(insert(cls), [
+            {'version': version, 'old': None, 'new': None} if change is None
+            else {'version': version, 'old': change[0], 'new': change[1]}
+            for change in changes])
+        logged = session.info.setdefault('logged_versions', set())
+        if version not in logged:
+            logged.add(version)
+            if version % cls.TRIM_EVERY == 0:
+                connection.execute(delete(cls).where(cls.version <= version - cls.RETENTION))
+
+    @classmethod
+    def since(cls, version, until, limit):
+        """Up to ``limit`` (old, new) pairs logged after ``version`` up to ``until``, oldest first."""
+        rows = db.session.execute(
+            select(cls.old, cls.new)
+            .where(cls.version > version, cls.version <= until)
+            .order_by(cls.version, cls.id)
+            .limit(limit))
+        return [(old, new) for old, new in rows]
+
+
+def _weak(callback):
+    return weakref.WeakMethod(callback) if hasattr(callback, '__self__') else weakref.ref(callback)
+
+
+def _call_live(refs, *args):
+    live = []
+    for ref in refs:
+        callback = ref()
+        if callback is not None:
+            callback(*args)
+            live.append(ref)
+    return live
+
+
+def committed_format(question):
+    """Question.format() as of the last flush, ignoring pending changes."""
+    state = inspect(question)
+    formatted = question.format()
+    for field in formatted:
+        history = state.attrs[field].history
+        if history.deleted:
+            formatted[field] = history.deleted[0]
+    return formatted
+
+
+def question_tags(*categories):
+    """Write tags for question changes in ``categories``."""
+    return {'questions:list'} | {f'category:{category}' for category in categories}
+
+# Model classes whose writes move DataVersion stamps. Category types are
+# part of question search results (searchMode=fields), so category
+# writes move the 'questions' stamp as well.
+VERSIONED_MODELS = {Category: ('categories', 'questions'), Question: ('questions',)}
+
+
+"""
+Session hooks that keep QuestionCount and DataVersion in the same
+transaction as the writes themselves, whether they come from
+Question.insert(), Question.delete(), a plain session.add()/delete(), or
+a bulk statement.
+"""
+@event.listens_for(Session, 'after_flush')
+def track_flushed_writes(session, flush_context):
+    deltas = Counter()
+    versions = set()
+    touched = set()
+    for obj in session.new:
+        if isinstance(obj, Question):
+            deltas[str(obj.category)] += 1
+            deltas[QuestionCount.ALL] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Question):
+            deltas[str(obj.category)] -= 1
+            deltas[QuestionCount.ALL] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Question):
+            history = inspect(obj).attrs.category.history
+            if history.deleted and history.added:
+                deltas[str(history.deleted[0])] -= 1
+                deltas[str(history.added[0])] += 1
+                touched.add(str(history.deleted[0]))
+    changes = []
+    for obj in session.new | session.deleted | session.dirty:
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if type(obj) in VERSIONED_MODELS:
+            versions.update(VERSIONED_MODELS[type(obj)])
+        if isinstance(obj, Question):
+            touched.add(str(obj.category))
+            changes.append((
+                None if obj in session.new else committed_format(obj),
+                None if obj in session.deleted else obj.format()))
+
+    if deltas:
+        QuestionCount.apply(session.connection(), deltas)
+    if versions:
+        DataVersion.bump(session, session.connection(), versions)
+    if touched:
+        DataVersion.tag_writes(session, question_tags(*touched))
+    if changes:
+        QuestionChange.record(session, session.connection(), changes)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_bulk_writes(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if orm_execute_state.is_select or mapper is None:
+        return None
+    model = mapper.class_
+    if model is not Question and model not in VERSIONED_MODELS:
+        return None
+
+    result = orm_execute_state.invoke_statement()
+    session = orm_execute_state.session
+    connection = session.connection()
+    if model is Question:
+        params = orm_execute_state.parameters
+        if orm_execute_state.is_insert and isinstance(params, list):
+            deltas = Counter(str(row['category']) for row in params)
+            deltas[QuestionCount.ALL] = len(params)
+            QuestionCount.apply(connection, deltas)
+            DataVersion.tag_writes(session, question_tags(*(c for c in deltas if c != QuestionCount.ALL)))
+        else:
+            # Bulk UPDATE/DELETE criteria don't say which rows they touched.
+            QuestionCount.rebuild(connection)
+            DataVersion.tag_writes(session, question_tags() | {'questions:bulk'})
+    if model in VERSIONED_MODELS:
+        DataVersion.bump(session, connection, VERSIONED_MODELS[model])
+    if model is Question:
+        QuestionChange.record(session, connection, [None])
+    return result
+
+
+@event.listens_for(Session, 'after_commit')
+def notify_version_subscribers(session):
+    session.info.pop('bumped_versions', None)
+    session.info.pop('logged_versions', None)
+    tags = session.info.pop('written_tags', None)
+    if tags:
+        DataVersion.notify(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_written_tags(session):
+    for key in ('bumped_versions', 'logged_versions', 'written_tags'):
+        session.info.pop(key, None)
@@ -1,8 +1,27 @@
+import fnmatch
+import math
 import os
+import random
+import tempfile
+import threading
+import time
 import unittest
+from array import array
+from flask import Response
 from dotenv import load_dotenv
 from flaskr import create_app
-from models import db, Question, Category
+from flaskr.cache import MemoryBackend, FileBackend, RedisBackend, ResponseCache
+from flaskr.singleflight import SingleFlight
+from flaskr.search.inverted import InvertedIndex, tokenize, BM25_B, BM25_K1
+from flaskr.search.results import SearchResultCache, normalize_query
+from flaskr.search.telemetry import SearchTelemetry
+from flaskr.quiz.sessions import MemoryQuizStore, SqlQuizStore
+from flaskr.quiz.permutation import feistel
+from flaskr.quiz.pools import QuizPools
+from flaskr.search.highlight import highlight_pattern, highlight_text, HIGHLIGHT_SNIPPET_CHARS
+from flaskr.search.fuzzy import FuzzyVocabulary, levenshtein
+from sqlalchemy import delete, insert, select
+from models import db, increment, Question, Category, DataVersion, QuestionChange
 
 class TriviaTestCase(unittest.TestCase):
     """Test suite for Trivia application."""
@@ -60,6 +79,60 @@ class TriviaTestCase(unittest.TestCase):
             ])
             db.session.commit()
 
+    def test_get_categories_follows_writes(self):
+        self.client.get('/categories')
+        with self.app.app_context():
+            category = Category(type='Music')
+            db.session.add(category)
+            db.session.commit()
+            cat_id = category.id
+        data = self.client.get('/categories').get_json()
+        self.assertEqual(data['categories'].get(str(cat_id)), 'Music')
+
+        with self.app.app_context():
+            db.session.delete(db.session.get(Category, cat_id))
+            db.session.commit()
+        data = self.client.get('/categories').get_json()
+        self.assertNotIn(str(cat_id), data['categories'])
+
+    def test_get_categories_not_modified(self):
+        first = self.client.get('/categories')
+        etag = first.headers['ETag']
+        response = self.client.get('/categories', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_error_responses_have_no_etag(self):
+        etag = self.client.get('/questions?page=1').headers['ETag']
+        self.assertNotEqual(self.client.get('/questions?page=2').headers['ETag'], etag)
+        response = self.client.get('/questions?page=1000', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_category_rename_changes_search_etag(self):
+        etag = self.client.get('/questions/search?q=title').headers['ETag']
+        with self.app.app_context():
+            category = db.session.get(Category, 1)
+            category.type, old_type = category.type + ' (renamed)', category.type
+            db.session.commit()
+        self.assertNotEqual(self.client.get('/questions/search?q=title').headers['ETag'], etag)
+        with self.app.app_context():
+            db.session.get(Category, 1).type = old_type
+            db.session.commit()
+
+    def test_get_questions_etag_changes_on_write(self):
+        etag = self.client.get('/questions?page=1').headers['ETag']
+        self.post_json('/questions', {
+            "question": "What is the chemical symbol for gold?",
+            "answer": "Au",
+            "category": 1,
+            "difficulty": 2
+        })
+        response = self.client.get('/questions?page=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertTrue(response.get_json()['success'])
+
     def test_get_paginated_questions(self):
         response = self.client.get('/questions?page=1')
         data = response.get_json()
@@ -68,6 +141,39 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIn('questions', data)
         self.assertIsInstance(data['questions'], list)
 
+    def test_get_paginated_questions_total(self):
+        response = self.client.get('/questions?page=1')
+        data = response.get_json()
+        with self.app.app_context():
+            total = Question.query.count()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['totalQuestions'], total)
+        self.assertLessEqual(len(data['questions']), 10)
+
+    def test_list_rows_match_orm_format(self):
+        data = self.client.get('/questions?page=1').get_json()
+        first = data['questions'][0]
+        with self.app.app_context():
+            self.assertEqual(first, db.session.get(Question, first['id']).format())
+
+    def test_get_questions_by_cursor(self):
+        first = self.client.get('/questions?page=1').get_json()
+        seen = [q['id'] for q in first['questions']]
+        cursor = first['next_cursor']
+        while cursor:
+            data = self.client.get(f'/questions?cursor={cursor}').get_json()
+            self.assertTrue(data['success'])
+            seen.extend(q['id'] for q in data['questions'])
+            cursor = data['next_cursor']
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), first['totalQuestions'])
+
+    def test_get_questions_by_cursor_error(self):
+        response = self.client.get('/questions?cursor=not-a-cursor')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_get_paginated_questions_error(self):
         response = self.client.get('/questions?page=999')
         data = response.get_json()
@@ -128,6 +234,275 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertIn('questions', data)
 
+    def test_search_question_paginated(self):
+        response = self.post_json('/questions', {"searchTerm": "a", "limit": 2})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(data['questions']), 2)
+        with self.app.app_context():
+            total = Question.query.filter(Question.question.ilike('%a%')).count()
+        self.assertEqual(data['totalQuestions'], total)
+        self.assertFalse(data['totalIsEstimate'])
+
+    def test_search_question_limit_error(self):
+        response = self.post_json('/questions', {"searchTerm": "a", "limit": 0})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_search_question_fulltext(self):
+        response = self.post_json('/questions', {"searchTerm": "discover*", "searchMode": "fulltext"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIn("Who discovered penicillin?", [q['question'] for q in data['questions']])
+
+    def test_search_question_fulltext_phrase(self):
+        response = self.post_json('/questions', {"searchTerm": '"world cup"', "searchMode": "fulltext"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        for question in data['questions']:
+            self.assertIn('world cup', question['question'].lower())
+
+    def test_search_question_fulltext_fields(self):
+        response = self.post_json('/questions', {"searchTerm": "Escher", "searchMode": "fields"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'][0]['answer'], "Escher")
+
+        data = self.post_json('/questions', {"searchTerm": "geography", "searchMode": "fields"}).get_json()
+        self.assertTrue(data['questions'])
+        self.assertTrue(all(str(q['category']) == '3' for q in data['questions']))
+
+    def test_search_question_fields_weights_error(self):
+        response = self.post_json('/questions', {
+            "searchTerm": "Escher", "searchMode": "fields", "weights": {"answer": 5}})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_search_question_trigram(self):
+        response = self.post_json('/questions', {"searchTerm": "scarab", "searchMode": "trigram"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Scarab", [q['answer'] for q in data['questions']])
+
+    def test_search_question_trigram_similar(self):
+        response = self.post_json('/questions', {
+            "searchTerm": "penicilin", "searchMode": "similar", "similarity": 0.5})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'][0]['answer'], "Alexander Fleming")
+
+    def test_trigram_index_used_explain(self):
+        from flaskr.search import search_statement
+        with self.app.app_context():
+            stmt, _ = search_statement('trigram', 'penicillin')
+            connection = db.session.connection()
+            # The sample data is tiny, so take sequential scans off the table
+            connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            compiled = stmt.compile(dialect=connection.dialect)
+            plan = '\n'.join(row[0] for row in connection.exec_driver_sql(
+                'EXPLAIN ' + str(compiled), compiled.params))
+            db.session.rollback()
+        self.assertIn('questions_question_trgm_idx', plan)
+        self.assertIn('questions_answer_trgm_idx', plan)
+
+    def test_search_question_index(self):
+        response = self.post_json('/questions', {"searchTerm": "penicillin", "searchMode": "index"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'][0]['answer'], "Alexander Fleming")
+
+    def test_search_index_follows_writes(self):
+        self.post_json('/questions', {
+            "question": "Which metal is liquid at room temperature?",
+            "answer": "Mercury",
+            "category": 1,
+            "difficulty": 2
+        })
+        payload = {"searchTerm": "liquid AND mercury", "searchMode": "index"}
+        data = self.post_json('/questions', payload).get_json()
+        self.assertEqual(data['questions'][0]['answer'], "Mercury")
+
+        self.client.delete(f"/questions/{data['questions'][0]['id']}")
+        response = self.post_json('/questions', payload)
+        self.assertEqual(response.status_code, 404)
+
+    def test_suggest_questions(self):
+        response = self.client.get('/questions/suggest?prefix=penic')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIn('penicillin', data['terms'])
+
+        data = self.client.get('/questions/suggest?prefix=Who%20disc').get_json()
+        self.assertIn("Who discovered penicillin?", [q['question'] for q in data['questions']])
+
+    def test_suggest_questions_error(self):
+        response = self.client.get('/questions/suggest')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_search_question_fuzzy(self):
+        response = self.post_json('/questions', {"searchTerm": "penicilin", "searchMode": "fuzzy"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['correctedTerm'], 'penicillin')
+        self.assertEqual(data['questions'][0]['answer'], "Alexander Fleming")
+
+        data = self.post_json('/questions', {"searchTerm": "Versailes", "searchMode": "fuzzy"}).get_json()
+        self.assertEqual(data['questions'][0]['answer'], "The Palace of Versailles")
+
+    def test_search_question_fuzzy_error(self):
+        response = self.post_json('/questions', {"searchTerm": "qqqqqqqq", "searchMode": "fuzzy"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_search_question_fuzzy_keeps_operators(self):
+        data = self.post_json('/questions', {
+            "searchTerm": "penicilin OR Versailes", "searchMode": "fuzzy"}).get_json()
+        self.assertEqual(data['correctedTerm'], 'penicillin OR versailles')
+        self.assertEqual(data['totalQuestions'], 2)
+
+    def test_search_question_words_mode_is_internal(self):
+        response = self.post_json('/questions', {"searchTerm": "title", "searchMode": "words"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_question_mode_error(self):
+        response = self.post_json('/questions', {"searchTerm": "title", "searchMode": "telepathy"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_search_question_facets(self):
+        data = self.post_json('/questions', {"searchTerm": "title", "facets": True}).get_json()
+        self.assertEqual(sum(data['facets']['category'].values()), data['totalQuestions'])
+        self.assertEqual(sum(data['facets']['difficulty'].values()), data['totalQuestions'])
+
+        difficulty = next(iter(data['facets']['difficulty']))
+        filtered = self.post_json('/questions', {
+            "searchTerm": "title", "difficulty": difficulty, "facets": True}).get_json()
+        self.assertEqual(filtered['totalQuestions'], data['facets']['difficulty'][difficulty])
+        # Disjunctive: difficulty counts ignore their own filter, category counts don't
+        self.assertEqual(filtered['facets']['difficulty'], data['facets']['difficulty'])
+        self.assertEqual(sum(filtered['facets']['category'].values()), filtered['totalQuestions'])
+        self.assertFalse(filtered['facetsAreEstimate'])
+        self.assertTrue(all(q['difficulty'] == int(difficulty) for q in filtered['questions']))
+
+    def test_search_question_facets_index(self):
+        response = self.post_json('/questions', {
+            "searchTerm": "world cup", "searchMode": "index", "category": 6, "facets": True})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(q['category'] == '6' for q in data['questions']))
+        self.assertGreaterEqual(data['facets']['category']['6'], data['totalQuestions'])
+
+    def test_search_question_highlight(self):
+        response = self.post_json('/questions', {"searchTerm": "title", "highlight": True})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        for question in data['questions']:
+            marks = question['highlight']['question']
+            start, end = marks['offsets'][0]
+            self.assertEqual(question['question'][start:end].lower(), 'title')
+            self.assertIn('<mark>', marks['snippet'])
+
+        data = self.client.get('/questions/search?q=penicilin&mode=fuzzy&highlight=true').get_json()
+        self.assertIn('<mark>penicillin</mark>', data['questions'][0]['highlight']['question']['snippet'])
+
+    def test_top_searches(self):
+        for term in ("Title", "title ", "world cup"):
+            self.post_json('/questions', {"searchTerm": term})
+        self.client.get('/questions/search?q=TITLE')
+        response = self.client.get('/admin/search/top')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['searches'], 4)
+        self.assertEqual(data['terms'][0], {'term': 'title', 'count': 3})
+
+    def test_search_term_must_be_text(self):
+        response = self.post_json('/questions', {"searchTerm": 123})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.get_json()['success'])
+        self.assertEqual(self.client.get('/admin/search/top').get_json()['searches'], 0)
+
+    def test_warm_top_searches(self):
+        self.post_json('/questions', {"searchTerm": "world cup"})
+        data = self.post_json('/admin/search/warm', {}).get_json()
+        self.assertEqual(data['warmed'], ['world cup'])
+
+        before = self.client.get('/admin/cache/stats').get_json()['search']['hits']
+        self.client.get('/questions/search?q=world%20cup')
+        self.assertEqual(self.client.get('/admin/cache/stats').get_json()['search']['hits'], before + 1)
+
+    def test_search_question_filter_error(self):
+        response = self.post_json('/questions', {"searchTerm": "title", "difficulty": "hard"})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_search_questions(self):
+        response = self.client.get('/questions/search?q=Title')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['questions'])
+        self.assertIn('ETag', response.headers)
+
+        before = self.client.get('/admin/cache/stats').get_json()['search']
+        again = self.client.get('/questions/search?q=%20title%20').get_json()
+        after = self.client.get('/admin/cache/stats').get_json()['search']
+        self.assertEqual(again['questions'], data['questions'])
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertGreater(after['hitRate'], 0)
+
+    def test_get_search_questions_follows_writes(self):
+        query = '/questions/search?q=quicksilver&mode=index'
+        self.assertEqual(self.client.get(query).status_code, 404)
+        self.post_json('/questions', {
+            "question": "Which element was once called quicksilver?",
+            "answer": "Mercury",
+            "category": 1,
+            "difficulty": 2
+        })
+        data = self.client.get(query).get_json()
+        self.assertEqual(data['questions'][0]['answer'], "Mercury")
+        self.client.delete(f"/questions/{data['questions'][0]['id']}")
+
+    def test_search_index_replays_other_workers_writes(self):
+        query = '/questions/search?q=cinnabar&mode=index'
+        self.assertEqual(self.client.get(query).status_code, 404)
+        index = self.app.extensions['search_index']
+        state = index.state
+        question = {'question': "Which red mineral is an ore of mercury?", 'answer': "Cinnabar",
+                    'category': '1', 'difficulty': 2}
+        # Written as another worker would: logged and versioned, but this
+        # worker isn't told
+        with self.app.app_context(), db.engine.begin() as connection:
+            increment(connection, DataVersion.name, DataVersion.version, 'questions', 1)
+            version = connection.execute(
+                select(DataVersion.version).where(DataVersion.name == 'questions')).scalar()
+            question['id'] = connection.execute(insert(Question).values(**question)).inserted_primary_key[0]
+            connection.execute(insert(QuestionChange).values(version=version, old=None, new=question))
+        index.invalidate()
+
+        with self.app.app_context():
+            ids, _, _, _ = index.search('cinnabar')
+        self.assertEqual(ids, [question['id']])
+        self.assertIs(index.state, state)
+        self.assertEqual(index.synced_version, version)
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(delete(Question).where(Question.id == question['id']))
+
+    def test_get_search_questions_error(self):
+        response = self.client.get('/questions/search?q=%20')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_search_question_error(self):
         response = self.post_json('/questions', {"searchTerm": "zzzzzzzzzzz"})
         data = response.get_json()
@@ -141,12 +516,89 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertIn('questions', data)
 
+    def test_get_questions_by_category_paginated(self):
+        response = self.client.get('/categories/1/questions?per_page=1')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(data['questions']), 1)
+        with self.app.app_context():
+            total = Question.query.filter_by(category='1').count()
+        self.assertEqual(data['totalQuestions'], total)
+        if total > 1:
+            following = self.client.get(
+                f"/categories/1/questions?per_page=1&cursor={data['next_cursor']}").get_json()
+            self.assertGreater(following['questions'][0]['id'], data['questions'][0]['id'])
+
+    def test_get_questions_by_category_page_error(self):
+        response = self.client.get('/categories/1/questions?page=9999')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_get_questions_by_category_error(self):
         response = self.client.get('/categories/99999/questions')
         data = response.get_json()
         self.assertEqual(response.status_code, 404)
         self.assertFalse(data['success'])
 
+    def test_get_stats(self):
+        response = self.client.get('/stats')
+        data = response.get_json()
+        with self.app.app_context():
+            total = Question.query.count()
+            science = Question.query.filter_by(category='1').count()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['totalQuestions'], total)
+        self.assertEqual(data['categories'].get('1', 0), science)
+
+    def test_stats_follow_question_writes(self):
+        before = self.client.get('/stats').get_json()
+        self.post_json('/questions', {
+            "question": "Which planet has the most moons?",
+            "answer": "Saturn",
+            "category": 1,
+            "difficulty": 3
+        })
+        after_insert = self.client.get('/stats').get_json()
+        self.assertEqual(after_insert['totalQuestions'], before['totalQuestions'] + 1)
+        self.assertEqual(after_insert['categories']['1'], before['categories'].get('1', 0) + 1)
+
+        with self.app.app_context():
+            q_id = Question.query.filter_by(question="Which planet has the most moons?").first().id
+        self.client.delete(f'/questions/{q_id}')
+        after_delete = self.client.get('/stats').get_json()
+        self.assertEqual(after_delete['totalQuestions'], before['totalQuestions'])
+        self.assertEqual(after_delete['categories']['1'], before['categories'].get('1', 0))
+
+    def test_get_stats_error(self):
+        response = self.client.post('/stats')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(data['success'])
+
+    def test_response_cache_hits_and_invalidation(self):
+        self.client.get('/categories/1/questions')
+        self.client.get('/categories/1/questions')
+        stats = self.client.get('/admin/cache/stats').get_json()
+        self.assertTrue(stats['success'])
+        self.assertGreaterEqual(stats['hits'], 1)
+
+        self.post_json('/questions', {
+            "question": "What gas do plants absorb?",
+            "answer": "Carbon dioxide",
+            "category": 1,
+            "difficulty": 1
+        })
+        data = self.client.get('/categories/1/questions?per_page=100').get_json()
+        self.assertIn("What gas do plants absorb?", [q['question'] for q in data['questions']])
+
+    def test_cache_stats_error(self):
+        response = self.client.delete('/admin/cache/stats')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(data['success'])
+
     def test_play_quiz(self):
         payload = {
             "previous_questions": [],
@@ -158,5 +610,483 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertIn('question', data)
 
+    def test_play_quiz_skips_previous_questions(self):
+        with self.app.app_context():
+            ids = [q.id for q in Question.query.filter(Question.category == '1').all()]
+        payload = {"previous_questions": ids[1:], "quiz_category": {"id": 1}}
+        for _ in range(5):
+            data = self.post_json('/quizzes', payload).get_json()
+            self.assertEqual(data['question']['id'], ids[0])
+
+        payload['previous_questions'] = ids
+        data = self.post_json('/quizzes', payload).get_json()
+        self.assertTrue(data['success'])
+        self.assertIsNone(data['question'])
+
+    def test_play_quiz_sees_new_questions(self):
+        with self.app.app_context():
+            ids = [q.id for q in Question.query.filter(Question.category == '1').all()]
+        self.post_json('/questions', {
+            "question": "Which planet is known as the red planet?",
+            "answer": "Mars",
+            "category": 1,
+            "difficulty": 1
+        })
+        data = self.post_json('/quizzes', {
+            "previous_questions": ids, "quiz_category": {"id": 1}}).get_json()
+        self.assertEqual(data['question']['answer'], "Mars")
+        self.client.delete(f"/questions/{data['question']['id']}")
+
+    def play_permuted_quiz(self, client, category):
+        payload = {"quiz_category": {"id": category}, "index": 0}
+        asked = []
+        while True:
+            data = client.post('/quizzes', json=payload).get_json()
+            if data['done']:
+                self.assertIsNone(data['question'])
+                return asked
+            # Every request deals a question until the category is exhausted
+            asked.append(data['question']['id'])
+            payload.update(seed=data['seed'], index=data['index'])
+
+    def test_play_quiz_permutation(self):
+        with self.app.app_context():
+            ids = {q.id for q in Question.query.filter(Question.category == '1').all()}
+        self.assertEqual(sorted(self.play_permuted_quiz(self.client, 1)), sorted(ids))
+
+    def test_play_quiz_permutation_without_pools(self):
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.db_path, "TESTING": True,
+                          "QUIZ_POOLS": False})
+        with app.app_context():
+            ids = {q.id for q in Question.query.filter(Question.category == '1').all()}
+        self.assertEqual(sorted(self.play_permuted_quiz(app.test_client(), 1)), sorted(ids))
+
+    def test_play_quiz_permutation_error(self):
+        response = self.post_json('/quizzes', {"quiz_category": {"id": 1}, "seed": 3, "index": 0})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_quiz_session(self):
+        with self.app.app_context():
+            ids = {q.id for q in Question.query.filter(Question.category == '1').all()}
+        response = self.post_json('/quizzes/sessions', {"quiz_category": {"id": 1}})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 201)
+        session_id = data['session_id']
+
+        asked = set()
+        for step in range(1, len(ids) + 1):
+            data = self.post_json(f'/quizzes/sessions/{session_id}/next', {}).get_json()
+            self.assertNotIn(data['question']['id'], asked)
+            asked.add(data['question']['id'])
+            self.assertEqual(data['asked'], step)
+        self.assertEqual(asked, ids)
+        data = self.post_json(f'/quizzes/sessions/{session_id}/next', {}).get_json()
+        self.assertIsNone(data['question'])
+
+        data = self.post_json(f'/quizzes/sessions/{session_id}/finish', {}).get_json()
+        self.assertEqual(data['asked'], len(ids))
+
+    def test_quiz_session_skips_deleted_questions(self):
+        with self.app.app_context():
+            question = Question("Which gas do plants take in?", "Carbon dioxide", "1", 1)
+            question.insert()
+            question_id = question.id
+            count = Question.query.filter(Question.category == '1').count()
+        session_id = self.post_json('/quizzes/sessions', {"quiz_category": {"id": 1}}).get_json()['session_id']
+        self.client.delete(f'/questions/{question_id}')
+
+        asked = []
+        while True:
+            data = self.post_json(f'/quizzes/sessions/{session_id}/next', {}).get_json()
+            if data['question'] is None:
+                break
+            asked.append(data['question']['id'])
+        self.assertNotIn(question_id, asked)
+        self.assertEqual(len(asked), count - 1)
+
+    def test_quiz_session_error(self):
+        response = self.post_json('/quizzes/sessions/nosuchsession/next', {})
+        data = response.get_json()
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+
+class FakeRedis:
+    """Local stand-in for a Redis client: get/set(ex=)/scan_iter(match=)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, time.time() + ex if ex else None)
+
+    def scan_iter(self, match='*', count=None):
+        return [key for key in self.data if fnmatch.fnmatchcase(key, match)]
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    """Response cache backends, without the database."""
+
+    def check_backend(self, backend):
+        backend.set('GET /questions?page=1', {'body': 'one'}, ttl=30)
+        self.assertEqual(backend.get('GET /questions?page=1'), {'body': 'one'})
+        self.assertIsNone(backend.get('GET /questions?page=2'))
+        self.assertEqual(backend.get_tag('category:3'), '')
+        backend.set_tag('category:3', 'abc')
+        self.assertEqual(backend.get_tag('category:3'), 'abc')
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryBackend())
+
+    def test_memory_backend_lru_eviction(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set('a', 1, ttl=30)
+        backend.set('b', 2, ttl=30)
+        backend.get('a')
+        backend.set('c', 3, ttl=30)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), 1)
+        self.assertEqual(backend.evictions, 1)
+
+    def test_memory_backend_ttl(self):
+        backend = MemoryBackend()
+        backend.set('a', 1, ttl=0)
+        self.assertIsNone(backend.get('a'))
+
+    def test_memory_entries_follow_data_versions(self):
+        class Stamp:
+            version = 1
+
+            def current(self):
+                return self.version
+
+        categories, questions = Stamp(), Stamp()
+        cache = ResponseCache(MemoryBackend())
+        cache.track_versions({'categories': categories}, questions)
+        cache.set('GET /questions?', Response('one'), cache.tag_tokens(['questions:list']))
+        self.assertIsNotNone(cache.get('GET /questions?'))
+        # Another worker's write: no local invalidation, only a version move
+        questions.version = 2
+        self.assertIsNone(cache.get('GET /questions?'))
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_backend(FileBackend(directory))
+            other_worker = FileBackend(directory)
+            self.assertEqual(other_worker.get('GET /questions?page=1'), {'body': 'one'})
+            self.assertEqual(other_worker.get_tag('category:3'), 'abc')
+
+    def test_redis_backend(self):
+        client = FakeRedis()
+        client.set('other-app:key', 'x')
+        backend = RedisBackend(client)
+        self.check_backend(backend)
+        # Only this cache's entries count, not its tags or other keys
+        self.assertEqual(len(backend), 1)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """Request coalescing, without the database."""
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'page'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while flight.coalesced < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['page'] * 5)
+        self.assertEqual(flight.coalesced, 4)
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise KeyError('boom')
+        with self.assertRaises(KeyError):
+            flight.do('k', fail)
+        self.assertEqual(flight.do('k', lambda: 'ok'), 'ok')
+
+
+class InvertedIndexTestCase(unittest.TestCase):
+    """In-memory search index, without the database."""
+
+    def setUp(self):
+        self.index = InvertedIndex(app=None, check_interval=float('inf'))
+        self.index.state = self.index.new_state()
+        self.index._checked_at = time.monotonic()
+        for doc_id, question, answer, category, difficulty in [
+            (1, "Which country won the first soccer world cup?", "Uruguay", '6', 4),
+            (2, "Which team played in every world cup?", "Brazil", '6', 3),
+            (3, "Who discovered penicillin?", "Alexander Fleming", '1', 3),
+        ]:
+            self.index.add(self.index.state, {'id': doc_id, 'question': question, 'answer': answer,
+                                              'category': category, 'difficulty': difficulty})
+
+    def test_and_query(self):
+        ids, total, _, _ = self.index.search('world cup first')
+        self.assertEqual((ids, total), ([1], 1))
+
+    def test_operators_survive_normalizing(self):
+        self.assertEqual(normalize_query('World  AND Cup OR Penicillin'), 'world AND cup OR penicillin')
+        ids, total, _, _ = self.index.search(normalize_query('world AND first'))
+        self.assertEqual((ids, total), ([1], 1))
+
+    def test_result_cache_waits_for_the_index(self):
+        class Stamp:
+            def current(self):
+                return 5
+
+        cache = SearchResultCache(Stamp(), mirrors={'index': [self.index]})
+        key = ('index', 'world', 1, 10)
+        self.index._synced_version = 4
+        cache.get_or_search(key, lambda: 'stale')
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.index._synced_version = 5
+        cache.get_or_search(key, lambda: 'fresh')
+        self.assertEqual(cache.get_or_search(key, lambda: 'again'), 'fresh')
+
+    def test_or_query_ranks_by_bm25(self):
+        ids, total, _, _ = self.index.search('penicillin OR world cup')
+        self.assertEqual(total, 3)
+        self.assertEqual(ids[0], 3)
+
+    def test_filters_and_facets(self):
+        ids, total, facets, estimated = self.index.search(
+            'penicillin OR world cup', filters={'difficulty': 3}, facets=True)
+        self.assertFalse(estimated)
+        self.assertEqual((sorted(ids), total), ([2, 3], 2))
+        self.assertEqual(facets, {'category': {'1': 1, '6': 1}, 'difficulty': {'3': 2, '4': 1}})
+
+    def test_remove(self):
+        self.index.remove(self.index.state, {'id': 3, 'question': "Who discovered penicillin?",
+                                             'answer': "Alexander Fleming",
+                                             'category': '1', 'difficulty': 3})
+        self.assertEqual(self.index.search('penicillin'), ([], 0, None, False))
+        self.assertEqual(self.index.search('world')[1], 2)
+
+    def test_pruned_search_matches_full_ranking(self):
+        rng = random.Random(7)
+        words = ['river', 'king', 'ocean', 'film', 'city', 'palace', 'record', 'team']
+        questions = {}
+        for doc_id in range(10, 3010):
+            questions[doc_id] = {'id': doc_id, 'question': ' '.join(rng.choices(words, k=rng.randint(2, 12))),
+                                 'answer': rng.choice(words), 'category': str(rng.randint(1, 6)),
+                                 'difficulty': rng.randint(1, 5)}
+            self.index.add(self.index.state, questions[doc_id])
+
+        def ranked(groups, filters):
+            state = self.index.state
+            scores = {}
+            for doc_id, question in questions.items():
+                terms = tokenize(question['question']) + tokenize(question['answer'])
+                if not any(all(word in terms for word in group) for group in groups):
+                    continue
+                if any(question[key] != value for key, value in filters.items()):
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * len(terms) / state.average_length)
+                scores[doc_id] = 0.0
+                for word in {word for group in groups for word in group}:
+                    tf = terms.count(word)
+                    if tf:
+                        df = len(state.postings[word][0])
+                        idf = math.log(1 + (state.doc_count - df + 0.5) / (df + 0.5))
+                        scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id)), len(scores)
+
+        def check(text, groups, offset=0, filters=None):
+            ids, total, _, estimated = self.index.search(text, offset, 10, filters=filters)
+            expected, expected_total = ranked(groups, filters or {})
+            self.assertEqual(ids, expected[offset:offset + 10])
+            if not estimated:
+                self.assertEqual(total, expected_total)
+
+        # Long terms keep impact lists, which must follow later writes
+        self.index.search('river')
+        self.index.remove(self.index.state, questions.pop(10))
+        questions[3100] = {'id': 3100, 'question': 'river king river', 'answer': 'Ocean',
+                           'category': '2', 'difficulty': 1}
+        self.index.add(self.index.state, questions[3100])
+        check('river', [['river']])
+        check('river king', [['river', 'king']])
+        check('river king', [['river', 'king']], offset=40)
+        check('ocean OR film palace', [['ocean'], ['film', 'palace']])
+        check('city', [['city']], filters={'category': '2', 'difficulty': 1})
+        total = self.index.search('city', filters={'category': '2', 'difficulty': 1})[1]
+        self.assertEqual(total, ranked([['city']], {'category': '2', 'difficulty': 1})[1])
+
+
+class HighlightTestCase(unittest.TestCase):
+
+    def test_snippet_is_escaped_and_bounded(self):
+        text = 'A <b>tag</b> ' + 'padding ' * 100 + 'and the World Cup at the end'
+        marks = highlight_text(highlight_pattern('index', 'world OR cup'), text)
+        self.assertEqual([text[start:end] for start, end in marks['offsets']], ['World', 'Cup'])
+        self.assertIn('<mark>World</mark> <mark>Cup</mark>', marks['snippet'])
+        self.assertTrue(marks['snippet'].startswith('…'))
+        self.assertLessEqual(len(marks['snippet'].replace('<mark>', '').replace('</mark>', '')),
+                             HIGHLIGHT_SNIPPET_CHARS + 2)
+
+    def test_no_match(self):
+        self.assertIsNone(highlight_text(highlight_pattern('index', 'penicillin'), 'World Cup'))
+
+
+class QuizPoolsTestCase(unittest.TestCase):
+    """Quiz id pools, without the database."""
+
+    def setUp(self):
+        self.pools = QuizPools(app=None, check_interval=float('inf'))
+        self.pools.state = self.pools.new_state()
+        self.pools._checked_at = time.monotonic()
+        for question_id, category in [(1, '1'), (2, '2'), (3, '1'), (4, '1')]:
+            self.pools.add(self.pools.state, {'id': question_id, 'category': category})
+
+    def test_sample_skips_seen(self):
+        for _ in range(20):
+            self.assertEqual(self.pools.sample('1', {1, 3}), 4)
+        self.assertIsNone(self.pools.sample('1', {1, 3, 4}))
+        self.assertIn(self.pools.sample(0, {1}), {2, 3, 4})
+
+    def test_remove(self):
+        self.pools.remove(self.pools.state, {'id': 4, 'category': '1'})
+        self.assertIsNone(self.pools.sample('1', {1, 3}))
+        self.assertEqual(list(self.pools.state.pools['all']), [1, 2, 3])
+
+
+class FeistelTestCase(unittest.TestCase):
+
+    def test_bijection(self):
+        for bits in (2, 6, 10):
+            image = [feistel(i, 12345, bits) for i in range(1 << bits)]
+            self.assertEqual(sorted(image), list(range(1 << bits)))
+        self.assertNotEqual([feistel(i, 1, 10) for i in range(20)],
+                            [feistel(i, 2, 10) for i in range(20)])
+
+
+class QuizStoreTestCase(unittest.TestCase):
+    """Quiz session stores, without the app database."""
+
+    def check_store(self, store):
+        session = store.create('3', array('i', [12, 5, 9]))
+        loaded = store.get(session.id)
+        self.assertEqual(loaded.category, '3')
+        self.assertEqual(list(store.deck_ids(loaded, 1, 16)), [5, 9])
+        loaded.position, loaded.asked = 2, 2
+        store.save(loaded)
+        self.assertEqual(store.get(session.id).position, 2)
+        self.assertEqual(list(store.deck_ids(loaded, 3, 16)), [])
+
+        # Two steps from the same position: only the first one is stored
+        first, second = store.get(session.id), store.get(session.id)
+        first.position = second.position = 3
+        self.assertTrue(store.advance(first, 2))
+        self.assertFalse(store.advance(second, 2))
+        self.assertEqual(store.get(session.id).position, 3)
+        store.delete(session.id)
+        self.assertIsNone(store.get(session.id))
+
+    def test_memory_store(self):
+        self.check_store(MemoryQuizStore())
+
+    def test_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_store(SqlQuizStore.from_url(f'sqlite:///{directory}/quiz.db'))
+
+    def test_memory_store_drops_least_recently_used(self):
+        store = MemoryQuizStore(max_sessions=2)
+        first, second = store.create(None, array('i')), store.create(None, array('i'))
+        store.save(store.get(first.id))
+        store.create(None, array('i'))
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get(second.id))
+        self.assertIsNotNone(store.get(first.id))
+
+    def test_memory_store_bounds_deck_bytes(self):
+        deck_bytes = 100 * array('i').itemsize
+        store = MemoryQuizStore(max_bytes=2 * deck_bytes)
+        first = store.create(None, array('i', range(100)))
+        store.create(None, array('i', range(100)))
+        store.create(None, array('i', range(100)))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.deck_bytes, 2 * deck_bytes)
+        self.assertIsNone(store.get(first.id))
+
+    def test_expiry(self):
+        store = MemoryQuizStore(ttl=0)
+        self.assertIsNone(store.get(store.create(None, array('i')).id))
+
+
+class SearchTelemetryTestCase(unittest.TestCase):
+
+    def test_heavy_hitters(self):
+        telemetry = SearchTelemetry(k=3, width=64, depth=4)
+        for i in range(2000):
+            telemetry.record(f'rare {i}')
+            if i % 4 == 0:
+                telemetry.record('title')
+            if i % 10 == 0:
+                telemetry.record('world cup')
+        top = dict(telemetry.top())
+        self.assertLessEqual(len(top), 3)
+        self.assertGreaterEqual(top['title'], 500)
+        self.assertGreaterEqual(top['world cup'], 200)
+        self.assertEqual(telemetry.top(1)[0][0], 'title')
+
+
+class FuzzyVocabularyTestCase(unittest.TestCase):
+    """Query correction, without the database."""
+
+    def setUp(self):
+        self.vocabulary = FuzzyVocabulary(app=None, check_interval=float('inf'))
+        self.vocabulary.state = self.vocabulary.new_state()
+        self.vocabulary._checked_at = time.monotonic()
+        self.vocabulary.add(self.vocabulary.state, {
+            'id': 1, 'question': "Who painted the Mona Lisa?", 'answer': "Leonardo da Vinci",
+            'category': '2', 'difficulty': 3})
+
+    def test_short_word_transposition(self):
+        self.assertEqual(self.vocabulary.correct('teh'), 'the')
+        self.assertEqual(self.vocabulary.correct('lias'), 'lisa')
+
+    def test_operators_pass_through(self):
+        self.assertEqual(self.vocabulary.correct_query('Leonrado OR vinci AND mona'),
+                         'leonardo OR vinci AND mona')
+
+
+class LevenshteinTestCase(unittest.TestCase):
+
+    def test_distance(self):
+        self.assertEqual(levenshtein('penicilin', 'penicillin', 2), 1)
+        self.assertEqual(levenshtein('versailes', 'versailles', 2), 1)
+        self.assertEqual(levenshtein('kitten', 'sitting', 3), 3)
+
+    def test_distance_limit(self):
+        self.assertEqual(levenshtein('kitten', 'sitting', 1), 2)
+        self.assertEqual(levenshtein('a', 'abcdef', 2), 3)
+
+
 if __name__ == "__main__":
     unittest.main()
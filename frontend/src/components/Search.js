@@ -1,8 +1,10 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
   getInfo = (event) => {
@@ -10,12 +12,37 @@ class Search extends Component {
     this.props.submitSearch(this.state.query);
   };
 
-  handleInputChange = () => {
-    this.setState({
-      query: this.search.value,
+  getSuggestions = (prefix) => {
+    if (prefix.trim().length < 2) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    $.ajax({
+      url: `/questions/suggest?prefix=${encodeURIComponent(prefix)}`,
+      type: 'GET',
+      success: (result) => {
+        // Ignore answers for a prefix the user has already typed past
+        if (result.prefix !== this.state.query.trim()) {
+          return;
+        }
+        this.setState({
+          suggestions: [
+            ...result.questions.map((q) => q.question),
+            ...result.terms,
+          ],
+        });
+      },
+      error: () => {
+        this.setState({ suggestions: [] });
+      },
     });
   };
 
+  handleInputChange = () => {
+    const query = this.search.value;
+    this.setState({ query }, () => this.getSuggestions(query));
+  };
+
   render() {
     return (
       <form onSubmit={this.getInfo}>
@@ -23,7 +50,13 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='search-suggestions'
         />
+        <datalist id='search-suggestions'>
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion} value={suggestion} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );